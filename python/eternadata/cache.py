@@ -0,0 +1,395 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+### globals
+###############################################################################
+CACHE_DIR = os.environ.get('ETERNADATA_CACHE_DIR', os.path.join(
+    os.path.expanduser('~'), '.cache', 'eternadata'))
+CACHE_MAX_BYTES = int(os.environ.get(
+    'ETERNADATA_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+RESPONSE_TTL = float(os.environ.get(
+    'ETERNADATA_RESPONSE_TTL', 24 * 60 * 60))     # seconds
+DISCOVERY_TTL = 7 * 24 * 60 * 60                  # seconds, api descriptions
+RESCAN_STORES = 1000      # stores between rescans of the cache directory
+
+
+###############################################################################
+### columnar formats
+###############################################################################
+# prefer feather (columnar, memory-mapped reads), fall back to pickle
+if hasattr(pd.DataFrame, 'to_feather'):
+    def _write_feather(df, path):
+        df.to_feather(path)
+    _read_feather = pd.read_feather
+else:
+    try:
+        import feather
+        _write_feather = lambda df, path: feather.write_dataframe(df, path)
+        _read_feather = feather.read_dataframe
+    except ImportError:
+        logger.debug("for columnar caching, run: pip install feather-format")
+        _write_feather = _read_feather = None
+
+
+def _write_pickle(df, path):
+    df.to_pickle(path)
+
+
+FORMATS = [('.feather', _write_feather, _read_feather),
+           ('.pkl', _write_pickle, pd.read_pickle)]
+FORMATS = [_ for _ in FORMATS if _[1] is not None]
+
+
+###############################################################################
+### cache
+###############################################################################
+class DiskCache(object):
+    """
+    :directory of keyed entries, evicted least-recently-used first
+     once the total size exceeds max_bytes
+
+     the total size is tracked in memory, so the directory is only 
+     rescanned to evict, or every RESCAN_STORES stores (other processes 
+     may share the directory); entries are key + one of extensions
+    """
+    extensions = ()
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or CACHE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self._total = None
+        self._stores = 0
+        self._lock = threading.Lock()
+
+
+    def _size(self, path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+
+    def _commit(self, tmp_path, path):
+        """
+        :move a written entry into place, update the total size, evict
+         only when over max_bytes (or due for a rescan)
+        """
+        size, replaced = self._size(tmp_path), self._size(path)
+        os.rename(tmp_path, path)
+        with self._lock:
+            self._stores += 1
+            rescan = self._total is None or self._stores >= RESCAN_STORES
+            if not rescan:
+                self._total += size - replaced
+        if rescan or self._total > self.max_bytes:
+            self.evict()
+
+
+    def lookup(self, key):
+        """
+        :return path of the entry for key, or None
+        """
+        for ext in self.extensions:
+            path = os.path.join(self.directory, key + ext)
+            # mark as recently used (fails if there is no entry)
+            try:
+                os.utime(path, None)
+            except OSError:
+                continue
+            return path
+        return None
+
+
+    def store(self, key, ext, writer):
+        """
+        :write entry for key with writer(path), atomically
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=key, suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            writer(tmp_path)
+            path = os.path.join(self.directory, key + ext)
+            if self._size(tmp_path) > self.max_bytes:
+                # would be evicted right away
+                logger.debug("not caching {} (larger than max_bytes)"
+                             .format(path))
+                return None
+            self._commit(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+
+    def store_chunks(self, key, ext, chunks, header=''):
+        """
+        :yield chunks while writing them (after header) to the entry for
+         key, which is stored atomically once every chunk was read
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=key, suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                fid.write(header)
+                for chunk in chunks:
+                    fid.write(chunk)
+                    yield chunk
+            self._commit(tmp_path, os.path.join(self.directory, key + ext))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+    def remove(self, key):
+        for ext in self.extensions:
+            path = os.path.join(self.directory, key + ext)
+            size = self._size(path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            with self._lock:
+                if self._total is not None:
+                    self._total -= size
+
+
+    def entries(self):
+        """
+        :return [(mtime, size, path)] for all entries, oldest first
+        """
+        entries = []
+        for fn in os.listdir(self.directory):
+            if fn.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, fn)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+
+    def evict(self):
+        """
+        :remove least-recently-used entries until under max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logger.debug("evicted: {} (size={})".format(path, size))
+            except OSError:
+                pass
+        with self._lock:
+            self._total, self._stores = total, 0
+        return total
+
+
+
+class DataFrameCache(DiskCache):
+    """
+    :parsed dataframes, keyed by source path, mtime, size and parse params
+     (and VERSION, bumped when the loader's output changes)
+    """
+    VERSION = 2
+    extensions = tuple(ext for ext, _, _ in FORMATS)
+
+    def __init__(self, directory=None, max_bytes=None):
+        DiskCache.__init__(self, os.path.join(
+            directory or CACHE_DIR, 'dataframes'), max_bytes)
+
+
+    def key(self, fn, **params):
+        stat = os.stat(fn)
+        key = repr((self.VERSION, os.path.abspath(fn), stat.st_mtime, 
+                    stat.st_size, sorted(params.items())))
+        return hashlib.sha1(key).hexdigest()
+
+
+    def get(self, key):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        for ext, _, reader in FORMATS:
+            if not path.endswith(ext):
+                continue
+            try:
+                df = reader(path)
+                logger.debug("cache hit: {}".format(path))
+                return df
+            except Exception as e:
+                logger.warning("dropping unreadable cache entry: {} ({})"
+                               .format(path, e))
+                self.remove(key)
+        return None
+
+
+    def put(self, key, df):
+        # skip frames that couldn't stay cached
+        size = df.memory_usage(deep=True).sum()
+        if size > self.max_bytes:
+            logger.debug("not caching frame of {} bytes (max_bytes={})"
+                         .format(size, self.max_bytes))
+            return None
+        # columnar formats need a default index and string column names
+        if not (isinstance(df.index, pd.RangeIndex) and 
+                (len(df) == 0 or df.index[0] == 0)):
+            df = df.reset_index(drop=True)
+        for ext, writer, _ in FORMATS:
+            try:
+                path = self.store(key, ext, lambda path: writer(df, path))
+                if path is not None:
+                    logger.debug("cache store: {}".format(path))
+                return path
+            except Exception as e:
+                logger.debug("cache store failed (format={}, error={})"
+                             .format(ext, e))
+        return None
+
+
+class ResponseCache(DiskCache):
+    """
+    :http response bodies, keyed by (normalized) url, expiring after ttl
+    """
+    extensions = ('.json',)
+
+    def __init__(self, directory=None, max_bytes=None, ttl=None, 
+                 name='responses'):
+        DiskCache.__init__(self, os.path.join(
+            directory or CACHE_DIR, name), max_bytes)
+        self.ttl = RESPONSE_TTL if ttl is None else ttl
+
+
+    def key(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+    def open(self, url):
+        """
+        :return file positioned at the cached body for url, or None
+
+         entries are a json header line ({url, time}), then the raw body;
+         the time is stored since lookup() touches mtime for LRU
+        """
+        key = self.key(url)
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            fid = open(path, 'rb')
+            entry = json.loads(fid.readline())
+        except (IOError, ValueError) as e:
+            logger.warning("dropping unreadable cache entry: {} ({})"
+                           .format(path, e))
+            self.remove(key)
+            return None
+        if entry.get('url') != url or time.time() - entry['time'] > self.ttl:
+            fid.close()
+            self.remove(key)
+            return None
+        logger.debug("cache hit: {}".format(url))
+        return fid
+
+
+    def get(self, url):
+        fid = self.open(url)
+        if fid is None:
+            return None
+        with fid:
+            return fid.read().decode('utf-8')
+
+
+    def store_stream(self, url, chunks):
+        """
+        :yield chunks (bytes) of the body for url, caching them as they pass
+        """
+        header = json.dumps({'url': url, 'time': time.time()}) + '\n'
+        return self.store_chunks(self.key(url), '.json', chunks, header)
+
+
+    def put(self, url, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        try:
+            for _ in self.store_stream(url, [text]):
+                pass
+        except (IOError, OSError) as e:
+            logger.debug("cache store failed (url={}, error={})"
+                         .format(url, e))
+
+
+
+###############################################################################
+### module-level cache
+###############################################################################
+_config = {'enabled': True, 'directory': None, 'max_bytes': None,
+           'response_ttl': None}
+_caches = {}
+
+
+def configure_cache(enabled=True, directory=None, max_bytes=None,
+                    response_ttl=None):
+    """
+    :enable/disable the dataframe and response caches, or move/resize them
+    """
+    _config.update(enabled=enabled, directory=directory, max_bytes=max_bytes,
+                   response_ttl=response_ttl)
+    _caches.clear()
+
+
+def get_dataframe_cache():
+    """
+    :return shared DataFrameCache, or None when caching is disabled
+    """
+    if not _config['enabled']:
+        return None
+    if 'dataframes' not in _caches:
+        try:
+            _caches['dataframes'] = DataFrameCache(
+                _config['directory'], _config['max_bytes'])
+        except OSError as e:
+            logger.warning("disabling dataframe cache ({})".format(e))
+            _config['enabled'] = False
+            return None
+    return _caches['dataframes']
+
+
+def get_response_cache(name='responses', ttl=None):
+    """
+    :return shared ResponseCache (i.e. name='discovery'), or None when 
+     caching is disabled
+    """
+    if not _config['enabled']:
+        return None
+    if name not in _caches:
+        try:
+            _caches[name] = ResponseCache(
+                _config['directory'], _config['max_bytes'],
+                ttl or _config['response_ttl'], name=name)
+        except OSError as e:
+            logger.warning("disabling response cache ({})".format(e))
+            _config['enabled'] = False
+            return None
+    return _caches[name]
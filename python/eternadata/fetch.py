@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import Queue
+import urllib
+import urlparse
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+logger = logging.getLogger(__name__)
+
+import util
+import cache
+import scheduler
+
+
+###############################################################################
+### globals
+###############################################################################
+ETERNA_GET_URL = 'http://staging.eternagame.org/get/'
+
+POOL_CONNECTIONS = 8      # number of hosts with pooled connections
+POOL_MAXSIZE = 64         # keep-alive connections per host
+TIMEOUT = 60
+CONCURRENCY = 32          # requests in flight per FetchPool
+BATCH_SIZE = 50           # ids per multi-id request
+MAX_URL_LENGTH = 2000     # longest url a batch may grow to
+CHUNK_SIZE = 64 * 1024    # bytes per streamed read
+
+_local = threading.local()
+
+# requests in flight, {normalized url: _Call}
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+###############################################################################
+### urls
+###############################################################################
+def eterna_url(query_type, **params):
+    """
+    :format a staging.eternagame.org/get/ url, i.e.
+        eterna_url('project', nid=1234)
+    """
+    query = [('type', query_type)] + [(k, params[k]) for k in sorted(params)
+                                      if params[k] is not None]
+    # keep field lists readable (i.e. fields=n.nid,puz.nid)
+    query = '&'.join('{}={}'.format(k, ','.join(map(str, v)) 
+                                    if isinstance(v, list) else v) 
+                     for k, v in query)
+    return '{}?{}'.format(ETERNA_GET_URL, query)
+
+
+def normalize_url(url):
+    """
+    :canonical form of url, so equivalent queries share a cache entry
+     (i.e. lowercase scheme/host, sorted query params, no fragment)
+    """
+    parts = urlparse.urlsplit(url.strip())
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(
+        parts.query, keep_blank_values=True)))
+    # keep field lists readable (i.e. fields=n.nid,puz.nid)
+    query = query.replace('%2C', ',')
+    return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                                parts.path or '/', query, ''))
+
+
+###############################################################################
+### http
+###############################################################################
+def get_session():
+    """
+    :return this thread's requests.Session (keep-alive, pooled connections)
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                              pool_maxsize=POOL_MAXSIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+
+def _get(url, timeout=TIMEOUT, stream=False):
+    """
+    :GET url through the shared scheduler (rate limit, retries), return
+     the response
+    """
+    def get():
+        logger.debug("GET {}".format(url))
+        response = get_session().get(url, timeout=timeout, stream=stream)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return response
+    return scheduler.get_scheduler().call(url, get)
+
+
+
+class _Call(object):
+    """
+    :a request in flight, shared by every thread asking for the same url
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.text, self.error = None, None
+
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+
+def fetch(url, timeout=TIMEOUT, use_cache=True):
+    """
+    :GET url, return the response body as text
+
+     responses are served from the response cache while fresh, and
+     concurrent requests for the same url share a single GET
+    """
+    key = normalize_url(url)
+    responses = cache.get_response_cache() if use_cache else None
+    if responses is not None:
+        text = responses.get(key)
+        if text is not None:
+            return text
+
+    # join a request already in flight, or start one
+    with _inflight_lock:
+        call = _inflight.get(key)
+        owner = call is None
+        if owner:
+            call = _inflight[key] = _Call()
+    if not owner:
+        logger.debug("joining request in flight: {}".format(key))
+        return call.wait()
+
+    try:
+        call.text = _get(url, timeout=timeout).text
+        if responses is not None:
+            responses.put(key, call.text)
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+    return call.text
+
+
+def fetch_stream(url, timeout=TIMEOUT, use_cache=True, chunk_size=CHUNK_SIZE):
+    """
+    :GET url, yield the response body in chunks (bytes), never holding
+     the whole body in memory; responses are cached as in fetch
+    """
+    key = normalize_url(url)
+    responses = cache.get_response_cache() if use_cache else None
+    if responses is not None:
+        fid = responses.open(key)
+        if fid is not None:
+            with fid:
+                for chunk in iter(lambda: fid.read(chunk_size), ''):
+                    yield chunk
+            return
+
+    response = _get(url, timeout=timeout, stream=True)
+    try:
+        chunks = response.iter_content(chunk_size)
+        if responses is not None:
+            chunks = responses.store_stream(key, chunks)
+        for chunk in chunks:
+            yield chunk
+    finally:
+        response.close()
+
+
+def decode_json(text):
+    """
+    :decode an eterna response (escaped carriage returns are dropped)
+    """
+    return json.loads(text.replace('\\r', ''))
+
+
+def fetch_json(url, timeout=TIMEOUT, use_cache=True):
+    """
+    :GET url, return the decoded json response
+    """
+    return decode_json(fetch(url, timeout=timeout, use_cache=use_cache))
+
+
+def fetch_records(url, keys=[], timeout=TIMEOUT, use_cache=True):
+    """
+    :GET url, yield the json records under keys as they are parsed
+     (i.e. keys=['data', 'solutions'])
+    """
+    return util.iter_json(fetch_stream(url, timeout=timeout, 
+                                       use_cache=use_cache), keys)
+
+
+###############################################################################
+### concurrent fetching
+###############################################################################
+class FetchPool(object):
+    """
+    :fetch urls on a shared pool of limit threads, yielding results as they
+     arrive; more urls can be submitted while iterating, i.e.
+
+        with FetchPool(limit=64) as pool:
+            pool.submit(url, tag='solnid')
+            for tag, url, data, error in pool.as_completed():
+                ...
+    """
+
+    def __init__(self, limit=None, func=None):
+        self.limit = limit or CONCURRENCY
+        self.func = func or fetch_json
+        self._executor = util.get_executor('thread', self.limit)
+        self._results = Queue.Queue()
+        self._pending = 0
+
+
+    def _run(self, tag, url):
+        try:
+            self._results.put((tag, url, self.func(url), None))
+        except Exception as e:
+            self._results.put((tag, url, None, e))
+
+
+    @property
+    def pending(self):
+        return self._pending
+
+
+    def submit(self, url, tag=None):
+        self._pending += 1
+        self._executor.apply_async(self._run, (tag, url))
+        return self
+
+
+    def as_completed(self):
+        """
+        :yield (tag, url, result, error) in order of completion
+        """
+        while self._pending:
+            try:
+                item = self._results.get(timeout=1)
+            except Queue.Empty:
+                continue
+            self._pending -= 1
+            yield item
+
+
+    def close(self):
+        """
+        :wait for requests still in flight (the threads are shared)
+        """
+        for _ in self.as_completed():
+            pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        return False
+
+
+
+class BatchQueue(object):
+    """
+    :coalesce ids into multi-id requests (i.e. solnid=1,2,3), submitted to
+     a FetchPool once max_ids are queued or the url would exceed max_length;
+     results are tagged (tag, ids)
+    """
+
+    def __init__(self, pool, make_url, tag=None, max_ids=None,
+                 max_length=None):
+        self.pool = pool
+        self.make_url = make_url
+        self.tag = tag
+        self.max_ids = max(max_ids or BATCH_SIZE, 1)
+        self.max_length = max_length or MAX_URL_LENGTH
+        self._ids = []
+
+
+    def add(self, nid):
+        if self._ids and (len(self._ids) >= self.max_ids or len(
+                self.make_url(self._ids + [nid])) > self.max_length):
+            self.flush()
+        self._ids.append(nid)
+        if len(self._ids) >= self.max_ids:
+            self.flush()
+
+
+    def flush(self):
+        if self._ids:
+            ids, self._ids = tuple(self._ids), []
+            self.pool.submit(self.make_url(list(ids)), tag=(self.tag, ids))
+
+
+    def retry(self, ids):
+        """
+        :resubmit ids (i.e. of a rejected batch) as single-id requests
+        """
+        for nid in ids:
+            self.pool.submit(self.make_url([nid]), tag=(self.tag, (nid,)))
@@ -3,6 +3,7 @@
 import sys
 import os
 import json
+import time
 
 import inspect
 __source_file__ = os.path.splitext(os.path.basename(
@@ -22,9 +23,30 @@ import apiclient.discovery as discovery
 import oauth2client.file as oa2file
 import oauth2client.client as oa2client
 import oauth2client.tools as oa2tools
+import eternadata.metrics as metrics
 
 __app__ = os.path.splitext(os.path.basename(sys.argv[0]))[0]
 
+DEBUG_BODY_LIMIT = 2000   # bytes of request/response bodies logged at debug
+
+
+def _preview(content):
+    """
+    :short, printable form of a request/response body for debug logs
+     (bodies may be large, multipart or binary, so they aren't decoded)
+    """
+    if content is None:
+        return ''
+    if not isinstance(content, basestring):
+        return repr(content)
+    if len(content) <= DEBUG_BODY_LIMIT:
+        return content
+    return '{} ... ({} bytes)'.format(content[:DEBUG_BODY_LIMIT], len(content))
+
+
+def _size(content):
+    return len(content) if isinstance(content, basestring) else 0
+
 
 class OAuth2():
   
@@ -112,15 +134,27 @@ class OAuth2():
         http_request = http.request
 
         def _wrapper(uri, method="GET", body=None, headers=None, **kw):
-            resp, content = http_request(uri, method, body, headers, **kw)
-            logger.debug('Request\n{} {}\n{}\n\n{}'.format(
-                method, uri, 
-                pprint.pformat(headers) if headers else '', 
-                pprint.pformat(body) if body else ''))
-            logger.debug('Response\n{}\n\n{}'.format(
-                    "200 OK" if resp.status == '200' else pprint.pformat(resp), 
-                    pprint.pformat(json.loads(content))))
-            return resp, content
+            # no instrumentation, no overhead
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if not (debug or metrics.enabled()):
+                return http_request(uri, method, body, headers, **kw)
+
+            start, resp, content = time.time(), None, None
+            try:
+                resp, content = http_request(uri, method, body, headers, **kw)
+                return resp, content
+            finally:
+                metrics.record_request(
+                    'http', getattr(resp, 'status', None), 
+                    time.time() - start, _size(body), _size(content))
+                if debug:
+                    logger.debug('Request\n{} {}\n{}\n\n{}'.format(
+                        method, uri, 
+                        pprint.pformat(headers) if headers else '', 
+                        _preview(body)))
+                    logger.debug('Response\n{}\n\n{}'.format(
+                        "200 OK" if getattr(resp, 'status', None) == 200 
+                        else pprint.pformat(resp), _preview(content)))
 
         http.request = _wrapper
         return http
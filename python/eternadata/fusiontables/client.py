@@ -7,6 +7,9 @@ import sys
 import csv
 import os
 import json
+import time
+import copy
+import threading
 
 import getpass
 import requests
@@ -20,15 +23,94 @@ import logging
 logger = logging.getLogger( __name__ )
 
 import httplib2
-from apiclient.http import MediaFileUpload
+from apiclient.http import MediaFileUpload, BatchHttpRequest
 import apiclient.discovery as discovery
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
 
 import authorization.oauth2 as oauth2
 import authorization.clientlogin as clientlogin
+import eternadata.scheduler as scheduler
+import eternadata.cache as cache
+import eternadata.fetch as fetch
 
 __app__ = os.path.splitext(sys.argv[0])[0]
 
+BATCH_SIZE = 100          # requests per batch http request
+BATCH_URI = 'https://www.googleapis.com/batch'
+COLUMN_TYPES = ('STRING', 'NUMBER', 'DATETIME', 'LOCATION')
+
+
+###############################################################################
+### shared clients
+###############################################################################
+_registry = {'oauth2': None, 'services': {}}
+_registry_lock = threading.RLock()
+_local = threading.local()
+
+
+def get_oauth2():
+    """
+    :return the process-wide OAuth2 (credentials loaded, or flow run, once)
+    """
+    with _registry_lock:
+        if _registry['oauth2'] is None:
+            _registry['oauth2'] = oauth2.OAuth2()
+        return _registry['oauth2']
+
+
+def get_http():
+    """
+    :return this thread's authorized http (httplib2.Http is not thread-safe,
+     so every thread gets its own, sharing the credentials)
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = _local.http = get_oauth2().http()
+    return http
+
+
+def discovery_document(api, version):
+    """
+    :return the discovery document of api, from the disk cache when fresh
+    """
+    url = discovery.DISCOVERY_URI.format(api=api, apiVersion=version)
+    documents = cache.get_response_cache('discovery', ttl=cache.DISCOVERY_TTL)
+    document = documents.get(url) if documents is not None else None
+    if document is None:
+        document = fetch.fetch(url, use_cache=False)
+        if documents is not None:
+            documents.put(url, document)
+    return document
+
+
+def get_service(api='fusiontables', version='v2'):
+    """
+    :return the process-wide service for api, built once from the cached 
+     discovery document
+    """
+    key = (api, version)
+    with _registry_lock:
+        if key not in _registry['services']:
+            logger.info("Building API Service ... (api={})".format(api))
+            http = get_http()
+            try:
+                service = discovery.build_from_document(
+                    discovery_document(api, version), http=http)
+            except Exception as e:
+                logger.warning("discovery cache failed, building directly"
+                               " ({})".format(e))
+                service = discovery.build(api, version, http=http)
+            _registry['services'][key] = service
+        return _registry['services'][key]
+
+
+def get_client(table_id=None):
+    """
+    :return a client for table_id, sharing credentials and services; 
+     clients keep no per-call state, so one can be used from many threads
+    """
+    return FTClientOAuth2(table_id)
+
 
 
                      
@@ -37,14 +119,13 @@ class FTClientOAuth2():
     def __init__(self, table_id=None):
 
         self.table_id = table_id
-        self.Table()
+        logger.debug("(TableID={})".format(self.table_id))
 
         # init URLs
         self.FUSIONTABLES_URL = self.build_uri('/view')
                          
-        # authorize http on init
-        self.oauth2 = oauth2.OAuth2()
-        self.http = self.oauth2.http()
+        # shared credentials and services (see get_service)
+        self.oauth2 = get_oauth2()
 
         self.apis = namedtuple('apis', ['fusiontables'])
         self.init_services()
@@ -52,15 +133,26 @@ class FTClientOAuth2():
         self._table = self.apis.fusiontables.table
         self._column = self.apis.fusiontables.column
         self._query = self.apis.fusiontables.query
-    
-        self.request = None
+
+
+    @property
+    def http(self):
+        """
+        :the calling thread's authorized http
+        """
+        return get_http()
 
      
     def Table(self, table_id=None):
-        if table_id:
-            self.table_id = table_id
-        logger.debug("(TableID={})".format(self.table_id))
-        return self
+        """
+        :return a view of table_id (this table by default), sharing this 
+         client's services; this client is left unchanged
+        """
+        table = copy.copy(self)
+        table.table_id = table_id or self.table_id
+        table.FUSIONTABLES_URL = table.build_uri('/view')
+        logger.debug("(TableID={})".format(table.table_id))
+        return table
 
                          
     def init_services(self):
@@ -72,10 +164,7 @@ class FTClientOAuth2():
             # skip if api service already built
             if not isinstance(service, property):
                 continue
-            # build api service
-            logger.info("Building API Service ... (api={})".format(api))
-            service = discovery.build(api, 'v2', http=self.http)
-            setattr(self.apis, api, service)
+            setattr(self.apis, api, get_service(api, 'v2'))
 
 
     def build_uri(self, uri_type, params=None):
@@ -96,48 +185,79 @@ class FTClientOAuth2():
         return uri
 
 
-    def _process_request(self, name='request', resumable=False):
+    def _execute(self, request, method='execute'):
+        """
+        :run request, or one of its methods, on this thread's http through
+         the shared scheduler, retrying 429/5xx with backoff (only 429 for
+         requests that change something, other than resumable uploads)
+        """
+        call = scheduler.get_scheduler().call
+        if method == 'execute' and \
+                getattr(request, 'method', 'GET').upper() != 'GET':
+            call = scheduler.get_scheduler().call_once
+        return call(request.uri, getattr(request, method), http=self.http)
+
+
+    def iter_pages(self, request):
+        """
+        :execute request, yielding each page of the response as it 
+         arrives, following nextPageToken
+        """
+        if not hasattr(request, 'execute'):
+            # already a response
+            yield request
+            return
+
+        page = self._execute(request)
+        while True:
+            if type(page) == str:
+                page = json.loads(page)
+            yield page
+            if not page.get('nextPageToken'):
+                break
+
+            # process url, params (add pageToken=nextPageToken to url)
+            url = urlparse.urlparse(request.uri)
+            query = dict(urlparse.parse_qsl(url.query)) 
+            query.update(pageToken=page.get('nextPageToken'))
+            request.uri = url._replace(
+                query=urllib.urlencode(query)).geturl()
+            logger.debug(request.uri)
+            page = self._execute(request)
+
+
+    def iter_items(self, request, key='items'):
+        """
+        :yield each item (i.e. column, or row with key='rows') of each page
+        """
+        for page in self.iter_pages(request):
+            for item in page.get(key, []):
+                yield item
+
+
+    def _process_request(self, request, name='request', resumable=False):
+        """
+        :execute request, return its (decoded) response
+        """
         response = None
         if resumable is True:
             # resumable 
             while response is None:
-                status, response = self.request.next_chunk()
+                status, response = self._execute(request, 'next_chunk')
                 logger.debug("response: {}".format(response))
                 if status:
                     prog = int(status.progress()*100)
                     logger.debug("{}.progress: {}".format(name, prog))
         else:
-            try:
-                response = self.request.execute()
-            except:
-                response = self.request 
-
-        # process multiple pages
-        if response.get('nextPageToken'):
-            _response = response
-            #logging.debug(pprint.pformat(_response))  
-            while response.get('nextPageToken'):
-                # process url, params (add pageToken=nextPageToken to url)
-                url = urlparse.urlparse(self.request.uri)
-                query = dict(urlparse.parse_qsl(url.query)) 
-                query.update(pageToken=response.get('nextPageToken'))
-                self.request.uri = url._replace(
-                    query=urllib.urlencode(query)).geturl()
-                logger.debug(self.request.uri)
-
-                # execute response
-                response = self.request.execute()
-                #logging.debug(pprint.pformat(response))
-
-                # update items in _response container
-                #logging.debug(pprint.pformat(len(_response)))
-                for k, v in _response.iteritems():
+            # accumulate lists from every page into the first page
+            for page in self.iter_pages(request):
+                if response is None:
+                    response = page
+                    continue
+                for k, v in response.iteritems():
                     if type(v) is list:
-                        _response[k] += response[k]
-       
-            # set response
-            response = _response
-            logging.debug(pprint.pformat(_response))
+                        response[k] += page.get(k, [])
+            logging.debug(pprint.pformat(response))
 
         # process response
         if type(response) == str:
@@ -145,32 +265,96 @@ class FTClientOAuth2():
 
         # signal complete
         logger.info("{} complete.".format(name))
-        
-        self.request = response
-        return True
+        return response
 
 
     def copy_table(self):
-        self.request = self._table().copy(tableId=self.table_id)
-        self._process_request(name='copy_table')
-        table_id = self.request.get('tableId')
+        response = self._process_request(
+            self._table().copy(tableId=self.table_id), name='copy_table')
+        table_id = response.get('tableId')
         return table_id
                 
 
+    def iter_columns(self):
+        """
+        :yield each column of the table, one page at a time
+        """
+        return self.iter_items(self._column().list(tableId=self.table_id))
+
+
     def list_columns(self):
-        self.request = self._column().list(tableId=self.table_id)
-        self._process_request(name='list_columns')
-        column_data = self.request.get('items', [])
+        response = self._process_request(
+            self._column().list(tableId=self.table_id), name='list_columns')
+        column_data = response.get('items', [])
         return column_data
 
 
-    def insert_columns(self, columns):
-        responses = []
+    def _new_batch(self, callback):
+        service = self.apis.fusiontables
+        if hasattr(service, 'new_batch_http_request'):
+            return service.new_batch_http_request(callback=callback)
+        return BatchHttpRequest(callback=callback)
+
+
+    def insert_columns(self, columns, types=None, column_type='NUMBER',
+                       batch_size=None):
+        """
+        :insert columns, batch_size inserts per batch http request
+
+            columns, list of names or (name, type) pairs
+            types (optional), {name: type}, column_type for the rest
+            (types: STRING, NUMBER, DATETIME, LOCATION)
+
+         returns the inserted column per column (None where it failed);
+         throttled inserts are retried in a later batch
+        """
+        batch_size = batch_size or BATCH_SIZE
+        types = types or {}
+        bodies = []
         for column in columns:
-            column_data = {"name":column, "type": "NUMBER"}
-            self.request = self._column().insert(self.table_id, body=column_data)
-            self._process_request(name='insert_columns')
-            responses.append(self.request)
+            name, ctype = column if isinstance(column, tuple) else (
+                column, types.get(column, column_type))
+            if ctype not in COLUMN_TYPES:
+                raise ValueError('Invalid column type: {} ({})'.format(
+                    ctype, name))
+            bodies.append({"name": name, "type": ctype})
+
+        responses, retry = [None] * len(bodies), []
+        def callback(request_id, response, exception):
+            idx = int(request_id)
+            if exception is None:
+                responses[idx] = response
+            elif scheduler.retry_status(exception,
+                                        idempotent=False) is not None:
+                retry.append(idx)
+            else:
+                logger.error("insert column failed: {} ({})".format(
+                    bodies[idx]['name'], exception))
+
+        pending, attempt = range(len(bodies)), 0
+        while pending:
+            retry = []
+            for start in range(0, len(pending), batch_size):
+                batch = self._new_batch(callback)
+                for idx in pending[start:start + batch_size]:
+                    batch.add(self._column().insert(
+                        tableId=self.table_id, body=bodies[idx]),
+                              request_id=str(idx))
+                scheduler.get_scheduler().call_once(
+                    getattr(batch, '_batch_uri', None) or BATCH_URI,
+                    batch.execute, http=self.http)
+                logger.info("insert_columns: {} of {} sent".format(
+                    min(start + batch_size, len(pending)), len(pending)))
+
+            pending, attempt = sorted(retry), attempt + 1
+            if pending and attempt > scheduler.get_scheduler().max_retries:
+                logger.error("giving up on {} columns: {}".format(
+                    len(pending), [bodies[_]['name'] for _ in pending]))
+                break
+            if pending:
+                time.sleep(scheduler.get_scheduler().backoff(attempt))
+
+        logger.info("insert_columns complete.")
         return responses
 
 
@@ -181,8 +365,7 @@ class FTClientOAuth2():
             see: https://developers.google.com/resources/api-libraries/documentation/fusiontables/v2/python/latest/fusiontables_v2.table.html
             importRows(tableId=*, media_body=None, **params)
         """
-        if table_id:
-            self.table_id = table_id
+        table_id = table_id or self.table_id
 
         params = {'startLine': 1, # skip cols?
                   'encoding': "UTF-8",
@@ -190,23 +373,33 @@ class FTClientOAuth2():
                   'isStrict': True}
 
         media = MediaFileUpload(csv_file, mimetype='text/csv', resumable=True)
-        self.request = self._table().importRows(tableId=self.table_id, media_body=media, **params)
-        self._process_request(name='import_rows', resumable=True)
+        request = self._table().importRows(tableId=table_id, media_body=media, **params)
+        self._process_request(request, name='import_rows', resumable=True)
         
         # URL for new look 
         logger.info("The fusion table is located at: {}".format(
-                self.build_uri('/view')))
+                self.Table(table_id).FUSIONTABLES_URL))
         return True   
 
 
-    def sql_select(self, columns="*"):
+    def _sql_select_request(self, columns="*"):
         if type(columns) == list:
             columns = ", ".join(columns)
-        self.request = self._query().sqlGet(
+        return self._query().sqlGet(
             sql="SELECT {columns} FROM {table_id}".format(
             columns=columns, table_id=self.table_id))
-        self._process_request('sql_select_column')
-        return self.request
+
+
+    def iter_rows(self, columns="*"):
+        """
+        :yield each row of SELECT columns, one page at a time
+        """
+        return self.iter_items(self._sql_select_request(columns), key='rows')
+
+
+    def sql_select(self, columns="*"):
+        return self._process_request(self._sql_select_request(columns),
+                                     'sql_select_column')
 
 
 
@@ -1,15 +1,51 @@
+import numpy as np
+import pandas as pd
+
 import client as ft
+import eternadata.util as util
 
 
 def upload_csv(table_id, csv_files):
     if type(csv_files) == str:
         csv_files = [csv_files]
-    ftclient = ft.FTClientOAuth2()
+    ftclient = ft.get_client()
     #ftable.save_copy()
     for csv_file in csv_files:
 		ftclient.Table(table_id).import_rows(csv_file)
     return True
-    
-  
-  
-  
\ No newline at end of file
+
+
+def upload_csvs(uploads, workers=None):
+    """
+    :upload_csv for each (table_id, csv_files), the tables concurrently
+    """
+    results = util.map_async(lambda _: upload_csv(*_), list(uploads),
+                             workers=workers)
+    return all(results.get())
+
+
+def _is_numeric(s):
+    """
+    :True if every non-blank value of s (i.e. text, loaded with
+     na_filter=False) is a number, and there is at least one
+    """
+    s = s.replace(r'^\s*$', np.nan, regex=True)
+    filled = s.notnull()
+    return bool(filled.any()) and \
+        (pd.to_numeric(s, errors='coerce').notnull() == filled).all()
+
+
+def column_types(df):
+    """
+    :fusion table column type per column of df, {name: type}; text
+     columns holding only numbers (and blanks) are NUMBER
+    """
+    kinds = {'M': 'DATETIME', 'i': 'NUMBER', 'u': 'NUMBER', 'f': 'NUMBER',
+             'b': 'NUMBER'}
+    types = {}
+    for name, s in df.iteritems():
+        ctype = kinds.get(getattr(s.dtype, 'kind', 'O'), 'STRING')
+        if ctype == 'STRING' and s.dtype.kind == 'O' and _is_numeric(s):
+            ctype = 'NUMBER'
+        types[name] = ctype
+    return types
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import heapq
+import shutil
+import tempfile
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+import util
+import schema
+
+
+###############################################################################
+### globals
+###############################################################################
+KEY = '_merge_key'
+
+
+###############################################################################
+### external sort
+###############################################################################
+def _sort_key(s):
+    """
+    :normalized key, so 1234, '1234' and 1234.0 sort and match together
+    """
+    return schema.as_int(s).astype(str)
+
+
+def _iter_run(fn, run_idx, chunksize):
+    """
+    :yield (key, run, seq, row) for each row of a sorted run
+    """
+    seq = itertools.count()
+    for df in pd.read_csv(fn, dtype=str, na_filter=False, encoding='utf-8',
+                          chunksize=chunksize):
+        for row in itertools.izip(*[df[c].values for c in df.columns]):
+            yield (row[0], run_idx, next(seq), row)
+
+
+def external_sort(fn, key='Design_ID', chunksize=100000, tmpdir=None):
+    """
+    Inputs:
+        + file name(s), anything load_dataframe accepts
+        + key, column to sort by
+        + chunksize, rows held in memory at a time
+
+    Outputs:
+        + generator of dataframes (values as str), sorted by key, with
+          the normalized key in the KEY column
+    """
+    tmpdir = tempfile.mkdtemp(prefix='eternadata_sort_', dir=tmpdir)
+    try:
+        # sort each chunk in memory, spill it to disk as a run
+        runs, columns = [], [KEY] + util.load_columns(fn)
+        for df in util.load_dataframe(fn, chunksize=chunksize, dtype=str):
+            df.insert(0, KEY, _sort_key(df[key]))
+            df = df.reindex(columns=columns).fillna('')
+            df = df.sort_values(KEY, kind='mergesort')
+            run_fn = os.path.join(tmpdir, 'run{}.csv'.format(len(runs)))
+            df.to_csv(run_fn, index=False, encoding='utf-8')
+            runs.append(run_fn)
+        logger.debug("sorted {} runs (key={})".format(len(runs), key))
+        if not runs:
+            return
+
+        # k-way merge of the runs, re-chunked
+        run_chunksize = max(chunksize // len(runs), 1000)
+        rows = heapq.merge(*[_iter_run(run_fn, idx, run_chunksize)
+                             for idx, run_fn in enumerate(runs)])
+        while True:
+            chunk = [_[-1] for _ in itertools.islice(rows, chunksize)]
+            if not chunk:
+                break
+            yield pd.DataFrame(chunk, columns=columns)
+
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+
+###############################################################################
+### merge
+###############################################################################
+def _update_chunk(target_df, source_df, columns):
+    """
+    :update target rows with the last non-empty source value per key
+    """
+    source_df = source_df.replace('', np.nan)
+    source_df = source_df.groupby(KEY)[columns].last()
+    source_df = source_df.reindex(target_df[KEY].values)
+    for c in columns:
+        values = source_df[c].values
+        mask = pd.notnull(values)
+        if mask.any():
+            target_df[c] = np.where(mask, values, target_df[c].values)
+    return target_df
+
+
+def merge_update(source, target, key='Design_ID', chunksize=100000,
+                 tmpdir=None):
+    """
+    Inputs:
+        + source, target file name(s)
+        + key, column to join on
+        + chunksize, rows held in memory at a time (per input)
+
+    Outputs:
+        + generator of target chunks, ordered by key, where non-empty
+          source values replace target values for rows with the same key
+    """
+    source_chunks = external_sort(source, key, chunksize, tmpdir)
+    pending = None
+    for target_df in external_sort(target, key, chunksize, tmpdir):
+        last_key = target_df[KEY].iloc[-1]
+
+        # read ahead in source, until past the last key of this chunk
+        while pending is None or not len(pending) or \
+                pending[KEY].iloc[-1] <= last_key:
+            source_df = next(source_chunks, None)
+            if source_df is None:
+                break
+            pending = source_df if pending is None else pd.concat(
+                [pending, source_df], ignore_index=True)
+        if pending is None:
+            pending = pd.DataFrame(columns=[KEY])
+
+        # join this chunk, keep rows that may match the next chunk
+        first_key = target_df[KEY].iloc[0]
+        matched = pending[(pending[KEY] >= first_key) &
+                          (pending[KEY] <= last_key)]
+        pending = pending[pending[KEY] >= last_key]
+
+        columns = [c for c in target_df.columns
+                   if c != KEY and c in matched.columns]
+        if len(matched):
+            target_df = _update_chunk(target_df, matched, columns)
+        yield target_df.drop(KEY, axis=1)
+
+
+def update_frame(target_df, source_df, key='Design_ID'):
+    """
+    Inputs:
+        + target, source dataframes
+        + key, column to join on
+
+    Outputs:
+        + target, ordered by key, where non-empty source values replace
+          target values for rows with the same key (merge_update, in memory)
+    """
+    target_df = target_df.copy()
+    target_df.insert(0, KEY, _sort_key(target_df[key]))
+    target_df = target_df.sort_values(KEY, kind='mergesort')
+    source_df = source_df.copy()
+    source_df.insert(0, KEY, _sort_key(source_df[key]))
+
+    columns = [c for c in target_df.columns
+               if c != KEY and c in source_df.columns]
+    target_df = _update_chunk(target_df, source_df, columns)
+    return target_df.drop(KEY, axis=1).reset_index(drop=True)
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import bisect
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+### globals
+###############################################################################
+ENABLED = os.environ.get('ETERNADATA_METRICS', '').lower() in ('1', 'true')
+
+# histogram bucket upper bounds, seconds and bytes
+LATENCY_BUCKETS = [0.005 * 2 ** i for i in range(16)]       # 5ms .. ~164s
+SIZE_BUCKETS = [256 * 4 ** i for i in range(12)]            # 256B .. 1GB
+
+
+###############################################################################
+### counters, histograms
+###############################################################################
+class Counter(object):
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+
+class Histogram(object):
+    """
+    :count of observations per bucket (upper bounds), plus count, sum,
+     min and max; percentiles are the upper bound of their bucket
+    """
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count, self.sum = 0, 0.0
+        self.min, self.max = None, None
+        self._lock = threading.Lock()
+
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+
+    def percentile(self, q):
+        """
+        :estimate of the q-th percentile (0..100), or None if empty
+        """
+        if not self.count:
+            return None
+        rank, seen = q / 100. * self.count, 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                bound = self.buckets[idx] if idx < len(self.buckets) \
+                    else self.max
+                return min(bound, self.max)
+        return self.max
+
+
+    def summary(self):
+        return {'count': self.count, 'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+
+###############################################################################
+### module-level registry
+###############################################################################
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+
+
+def enable(enabled=True):
+    """
+    :turn recording on (or off); while off, nothing is recorded
+    """
+    global ENABLED
+    ENABLED = enabled
+
+
+def enabled():
+    return ENABLED
+
+
+def counter(name):
+    """
+    :return the shared Counter name
+    """
+    with _lock:
+        if name not in _counters:
+            _counters[name] = Counter()
+        return _counters[name]
+
+
+def histogram(name, buckets=None):
+    """
+    :return the shared Histogram name (buckets apply on first use)
+    """
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(buckets or LATENCY_BUCKETS)
+        return _histograms[name]
+
+
+def record_request(prefix, status, seconds, sent=0, received=0):
+    """
+    :count a request (status None for a request that raised), its latency
+     and bytes sent/received, under prefix (i.e. 'http')
+    """
+    if not ENABLED:
+        return
+    counter('{}.requests'.format(prefix)).add()
+    counter('{}.status.{}'.format(prefix, status or 'error')).add()
+    counter('{}.bytes_sent'.format(prefix)).add(sent)
+    counter('{}.bytes_received'.format(prefix)).add(received)
+    histogram('{}.latency'.format(prefix), LATENCY_BUCKETS).observe(seconds)
+    histogram('{}.response_bytes'.format(prefix), SIZE_BUCKETS).observe(
+        received)
+
+
+def snapshot(prefix=''):
+    """
+    :return {'counters': {name: value}, 'histograms': {name: summary}},
+     for names starting with prefix
+    """
+    with _lock:
+        counters, histograms = dict(_counters), dict(_histograms)
+    return {'counters': dict((k, v.value) for k, v in counters.items()
+                             if k.startswith(prefix)),
+            'histograms': dict((k, v.summary()) for k, v in histograms.items()
+                               if k.startswith(prefix))}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
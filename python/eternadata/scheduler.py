@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import errno
+import random
+import socket
+import urlparse
+import threading
+
+import requests
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+### globals
+###############################################################################
+RATE = None               # requests per second, per host (None: unlimited,
+                          # only throttled when the host answers 429)
+BURST = 20                # requests sent back to back before throttling
+MAX_RETRIES = 5           # retries per request
+RETRY_BUDGET = 0.2        # retries allowed, as a fraction of requests per host
+MIN_RETRIES = 10          # retries allowed per host regardless of the budget
+BACKOFF_BASE = 0.5        # seconds, doubled per attempt
+BACKOFF_MAX = 60.0
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+UNSAFE_RETRY_STATUS = (429,)    # a throttled request was not processed
+
+
+class RetryError(Exception):
+    """
+    :a retryable failure that ran out of retries (or retry budget)
+    """
+
+
+
+###############################################################################
+### rate limiting
+###############################################################################
+class TokenBucket(object):
+    """
+    :allow rate requests per second on average, and bursts of up to burst;
+     with no rate (None or 0), requests only wait out pauses (i.e. on 429)
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = float(rate) if rate else None
+        self.burst = float(burst or BURST)
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+
+    def _refill(self, now):
+        if self.rate is None:
+            self._tokens = self.burst
+        else:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def acquire(self):
+        """
+        :block until a request may be sent
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+    def pause(self, delay):
+        """
+        :hold every request to this host for delay seconds (i.e. on 429)
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + delay)
+            self._tokens = 0
+
+
+
+class RetryBudget(object):
+    """
+    :cap retries at ratio * requests (plus min_retries), so retries can't
+     multiply the load on a host that is already failing
+    """
+
+    def __init__(self, ratio=None, min_retries=None):
+        self.ratio = RETRY_BUDGET if ratio is None else ratio
+        self.min_retries = MIN_RETRIES if min_retries is None else min_retries
+        self.requests, self.retries = 0, 0
+        self._lock = threading.Lock()
+
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+    def spend(self):
+        """
+        :return True (and count it) if another retry is allowed
+        """
+        with self._lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+
+
+###############################################################################
+### scheduler
+###############################################################################
+def _not_sent(error):
+    """
+    :True if error shows the request never reached the host
+     (name lookup failed, connection refused or timed out connecting)
+    """
+    if isinstance(error, (requests.exceptions.ConnectTimeout,
+                          socket.gaierror)):
+        return True
+    if type(error).__name__ == 'ServerNotFoundError':
+        # httplib2
+        return True
+    return isinstance(error, socket.error) and \
+        getattr(error, 'errno', None) == errno.ECONNREFUSED
+
+
+def retry_status(error, idempotent=True):
+    """
+    Inputs:
+        + exception raised by a request (requests, httplib2/apiclient)
+        + idempotent, False for requests that must not run twice (i.e.
+          POST), which are only retried when throttled (429), or when
+          they never reached the host
+
+    Outputs:
+        + (status, retry_after) if the request may be retried, else None
+    """
+    # requests (raise_for_status)
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        status = response.status_code
+        retry_after = response.headers.get('Retry-After')
+    # apiclient.errors.HttpError
+    elif hasattr(getattr(error, 'resp', None), 'status'):
+        status = error.resp.status
+        retry_after = error.resp.get('retry-after')
+    # connection errors, timeouts
+    elif _not_sent(error):
+        return (None, None)
+    elif isinstance(error, (requests.ConnectionError, requests.Timeout,
+                            socket.error)):
+        return (None, None) if idempotent else None
+    else:
+        return None
+
+    if status not in (RETRY_STATUS if idempotent else UNSAFE_RETRY_STATUS):
+        return None
+    try:
+        retry_after = float(retry_after)
+    except (TypeError, ValueError):
+        retry_after = None
+    return (status, retry_after)
+
+
+
+class Scheduler(object):
+    """
+    :run outbound calls through a token bucket per host, retrying
+     throttled (429), failed (5xx) or dropped requests with jittered
+     exponential backoff, within a retry budget per host; unless a rate
+     is given (rate=0 for none), hosts are only slowed down once they 
+     answer 429
+    """
+
+    def __init__(self, rate=None, burst=None, max_retries=None,
+                 retry_budget=None):
+        self.rate = RATE if rate is None else rate
+        self.burst = burst or BURST
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.retry_budget = retry_budget
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+
+    def host(self, url):
+        """
+        :return (TokenBucket, RetryBudget) for the host of url
+        """
+        host = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (TokenBucket(self.rate, self.burst),
+                                     RetryBudget(self.retry_budget))
+            return self._hosts[host]
+
+
+    def backoff(self, attempt):
+        """
+        :seconds to wait before retry attempt (full jitter)
+        """
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+    def call(self, url, func, *args, **kwds):
+        """
+        :return func(*args, **kwds), a request to url, once the host's
+         rate limit allows it, retrying retryable failures
+        """
+        return self._call(url, func, args, kwds)
+
+
+    def call_once(self, url, func, *args, **kwds):
+        """
+        :like call, for requests that must not run twice (i.e. POST);
+         only retried when throttled (429), or when they never reached
+         the host
+        """
+        return self._call(url, func, args, kwds, idempotent=False)
+
+
+    def _call(self, url, func, args, kwds, idempotent=True):
+        bucket, budget = self.host(url)
+        budget.record_request()
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                return func(*args, **kwds)
+            except Exception as e:
+                retry = retry_status(e, idempotent)
+                if retry is None:
+                    raise
+                status, retry_after = retry
+                if attempt >= self.max_retries or not budget.spend():
+                    raise RetryError("giving up after {} retries ({}: {})"
+                                     .format(attempt, url, e))
+                delay = self.backoff(attempt)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                if status == 429:
+                    # throttled, slow down every request to this host
+                    bucket.pause(delay)
+                attempt += 1
+                logger.warning("retrying in {:.1f}s, attempt {} (status={}, "
+                               "url={})".format(delay, attempt, status, url))
+                time.sleep(delay)
+
+
+
+###############################################################################
+### module-level scheduler
+###############################################################################
+_scheduler = {}
+
+
+def configure_scheduler(**kwds):
+    """
+    :replace the shared scheduler, i.e. configure_scheduler(rate=50)
+    """
+    _scheduler['default'] = Scheduler(**kwds)
+    return _scheduler['default']
+
+
+def get_scheduler():
+    """
+    :return the shared Scheduler
+    """
+    if 'default' not in _scheduler:
+        configure_scheduler()
+    return _scheduler['default']
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import fnmatch
+
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+### globals
+###############################################################################
+# column name patterns (fnmatch) for each compact type
+ETERNA_SCHEMA = {
+    'int': ['Project_ID', 'Puzzle_ID', 'Design_ID', 'Designer_ID'],
+    'category': ['Project_Name', 'Puzzle_Name', 'Designer_Name'],
+    'float32': ['*KD*', '*Fold_Change*'],
+}
+
+
+###############################################################################
+### converters
+###############################################################################
+def as_int(s):
+    """
+    :convert an id column to a fixed-width int column
+
+     columns with missing values can't be ints, so their numbers are
+     formatted as whole-number strings instead (i.e. 1234.0 -> '1234')
+    """
+    values = pd.to_numeric(s, errors='coerce')
+    present = values.notnull()
+    if not present.any():
+        return s
+    ints = values[present].round().astype(np.int64)
+    if present.all():
+        info = np.iinfo(np.int32)
+        if ints.min() >= info.min and ints.max() <= info.max:
+            return ints.astype(np.int32)
+        return ints
+    logger.debug("{} has missing values, formatting as strings"
+                 .format(s.name))
+    s = s.astype(object).copy()
+    s[present] = ints.astype(str)
+    return s
+
+
+def as_category(s):
+    if s.dtype != object:
+        return s
+    return s.astype('category')
+
+
+def as_float32(s):
+    """
+    :convert to float32 only if every value survives the round trip
+    """
+    if s.dtype != np.float64:
+        return s
+    s32 = s.astype(np.float32)
+    if (s32.astype(np.float64).eq(s) | s.isnull()).all():
+        return s32
+    return s
+
+
+CONVERTERS = {'int': as_int, 'category': as_category, 'float32': as_float32}
+
+
+###############################################################################
+### schema
+###############################################################################
+def schema_columns(columns, schema=None):
+    """
+    :return [(column, type)] for columns matched by schema patterns
+    """
+    if schema is None:
+        schema = ETERNA_SCHEMA
+    matched = []
+    for c in columns:
+        for kind, patterns in schema.items():
+            if any(fnmatch.fnmatchcase(str(c), _) for _ in patterns):
+                matched.append((c, kind))
+                break
+    return matched
+
+
+def apply_schema(df, schema=None):
+    """
+    Inputs:
+        + dataframe
+        + schema (optional), {type: [column patterns]}, ETERNA_SCHEMA default
+
+    Outputs:
+        + dataframe, with matched columns converted to compact types
+    """
+    for c, kind in schema_columns(df.columns, schema):
+        try:
+            df[c] = CONVERTERS[kind](df[c])
+        except (TypeError, ValueError) as e:
+            logger.warning("df[{}] -> {} failed\n(error={})".format(c, kind, e))
+    return df
+
+
+###############################################################################
+### normalization
+###############################################################################
+ID_COLUMNS = ["Project_ID", "Project_Round", 
+              "Puzzle_ID",  "Puzzle_Round", 
+              "Design_ID", "Designer_ID"]
+
+
+def normalize_ids(df, columns=None):
+    """
+    :ensure ids are ints (or whole-number strings, if values are missing)
+    """
+    return apply_schema(df, {'int': columns or ID_COLUMNS})
+
+
+def sequence_length(s):
+    """
+    :length of each stripped sequence, NaN where there is no sequence
+    """
+    if s.dtype != object:
+        return pd.Series(np.nan, index=s.index)
+    return s.str.strip().str.len()
+
+
+def fill_rounds(s, cloud_round):
+    """
+    :replace non-numeric synthesis rounds with cloud_round
+    """
+    return s.where(s.astype(str).str.isdigit(), cloud_round)
+
+
+def normalize_eterna_frame(df, cloud_round=None):
+    """
+    Inputs:
+        + dataframe (i.e. a transferred or collected set of designs)
+        + cloud_round (optional), round for designs with no Synthesis_Round
+
+    Outputs:
+        + dataframe, with ids, Sequence_Length and Synthesis_Round fixed up
+    """
+    df = normalize_ids(df)
+    if 'Sequence' in df.columns:
+        df['Sequence_Length'] = sequence_length(df['Sequence'])
+    if cloud_round and 'Synthesis_Round' in df.columns:
+        df['Synthesis_Round'] = fill_rounds(df['Synthesis_Round'], cloud_round)
+    return df
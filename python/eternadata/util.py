@@ -8,15 +8,27 @@ import inspect
 import os
 import csv
 import glob
+import gzip
+import math
+import atexit
+import decimal
+import threading
+import itertools
+import collections
+import multiprocessing.dummy as mp_dummy
 
 import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
 
 
 import pprint
 import logging
 logger = logging.getLogger(__name__)
 
+import cache
+import schema as eterna_schema
+
 
 ###############################################################################
 ### globals
@@ -101,25 +113,263 @@ except:
         logger(' '.join([_[1] for _ in extra]))
 
 
+###############################################################################
+### executors
+###############################################################################
+IO_WORKERS = 32     # threads for io-bound work (i.e. http requests)
+
+_executors = {}
+_executors_lock = threading.Lock()
+_executors_pid = os.getpid()
+
+
+def _reset_after_fork():
+    """
+    :a forked child gets a fresh lock (another thread may have held it)
+    """
+    global _executors_lock, _executors_pid
+    if _executors_pid != os.getpid():
+        _executors_lock = threading.Lock()
+        _executors_pid = os.getpid()
+
+
+def default_workers(workload='cpu'):
+    """
+    :worker count for a 'cpu' (one per core) or 'io' (IO_WORKERS) workload
+    """
+    if workload == 'io':
+        return IO_WORKERS
+    try:
+        return max(mp.cpu_count(), 1)
+    except NotImplementedError:
+        return 1
+
+
+
+class Executor(object):
+    """
+    :reusable pool of workers, backend 'thread' (io-bound work, or work
+     that releases the gil) or 'process' (cpu-bound work)
+
+     process workers are forked when the executor is created, so they
+     don't see module state changed afterwards
+    """
+
+    BACKENDS = {'thread': mp_dummy.Pool, 'process': mp.Pool}
+
+    def __init__(self, backend='thread', workers=None):
+        if backend not in self.BACKENDS:
+            raise ValueError('Invalid backend: {}'.format(backend))
+        self.backend = backend
+        self.workers = workers or default_workers(
+            'io' if backend == 'thread' else 'cpu')
+        self.pid = os.getpid()
+        self._pool = self.BACKENDS[backend](self.workers)
+
+
+    def chunksize(self, n_tasks):
+        """
+        :tasks sent to a worker at a time; threads take one at a time,
+         processes get ~4 batches each, to amortize pickling
+        """
+        if self.backend == 'thread' or not n_tasks:
+            return 1
+        return int(math.ceil(n_tasks / (4.0 * self.workers)))
+
+
+    def map(self, func, iterable, chunksize=None):
+        tasks = list(iterable)
+        return self._pool.map(func, tasks, 
+                              chunksize or self.chunksize(len(tasks)))
+
+
+    def map_async(self, func, iterable, chunksize=None):
+        tasks = list(iterable)
+        return self._pool.map_async(func, tasks, 
+                                    chunksize or self.chunksize(len(tasks)))
+
+
+    def imap(self, func, iterable, chunksize=None, ordered=True):
+        """
+        :yield results as they complete (ordered=False), or in order
+        """
+        tasks = list(iterable)
+        imap = self._pool.imap if ordered else self._pool.imap_unordered
+        return imap(func, tasks, chunksize or self.chunksize(len(tasks)))
+
+
+    def apply_async(self, func, args=(), callback=None):
+        return self._pool.apply_async(func, args, callback=callback)
+
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+
+def get_executor(backend='thread', workers=None):
+    """
+    Inputs:
+        + backend, 'thread' or 'process'
+        + workers (optional), sized by default_workers when not given
+
+    Outputs:
+        + shared Executor, created on first use and reused afterwards
+    """
+    _reset_after_fork()
+    key = (backend, workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+    # pools can't be shared with forked children
+    if executor is not None and executor.pid == os.getpid():
+        return executor
+
+    # start the pool outside the lock, forked workers would inherit it held
+    executor = Executor(backend, workers)
+    with _executors_lock:
+        current = _executors.get(key)
+        if current is None or current.pid != os.getpid():
+            _executors[key], current = executor, None
+    if current is not None:
+        # another thread started one first
+        executor.terminate()
+        return current
+    logger.debug("started {} executor (workers={})".format(
+        backend, executor.workers))
+    return executor
+
+
+@atexit.register
+def shutdown_executors():
+    """
+    :stop all shared executors
+    """
+    _reset_after_fork()
+    with _executors_lock:
+        for key, executor in _executors.items():
+            if executor.pid == os.getpid():
+                executor.terminate()
+        _executors.clear()
+
+
+
 ###############################################################################
 ### utility helpers
 ###############################################################################
 def dataframe_loader(fn, **params):
     """
+    Inputs:
+        + single file name, or list of file names
+        + chunksize (optional), yield bounded-size row chunks
+
+    Outputs:
+        + generator of pandas dataframes (one per file, or one per chunk)
     """
     # return generator of load_dataframe calls
     if not isinstance(fn, list):
         fn = [fn]
     for fn_i in fn:
-        yield load_dataframe(fn_i, **params) 
+        if params.get('chunksize'):
+            for df_i in load_dataframe(fn_i, **params):
+                yield df_i
+        else:
+            yield load_dataframe(fn_i, **params) 
+
+
+def iter_dataframe_chunks(df, chunksize):
+    """
+    :yield row slices of an in-memory dataframe 
+    """
+    for start in range(0, max(len(df), 1), chunksize):
+        yield df.iloc[start:start + chunksize]
 
 
-def load_dataframe_from_files(fn, df=pd.DataFrame(), **params):
+def _index_chunks(chunks):
     """
+    :number chunk rows consecutively, as if the chunks were one dataframe
+    """
+    start = 0
+    for df in chunks:
+        df.index = pd.RangeIndex(start, start + len(df))
+        start += len(df)
+        yield df
+
+
+def _align_chunks(chunks, columns):
+    """
+    :reindex each chunk to columns, so chunks of different files share a header
+    """
+    for df in chunks:
+        if columns and list(df.columns) != columns:
+            df = df.reindex(columns=columns)
+        yield df
+
+
+def _load_file_chunks(fn, sheet='Sheet1', sort=False, **params):
+    """
+    :stream chunks from each file in turn, aligned to the union of their
+     columns (sorted if sort or if the headers differ, as when the files
+     are concatenated in memory)
+    """
+    headers = [load_columns(fn_i, sheet=sheet) for fn_i in fn]
+    columns = _union_columns(headers)
+    if sort or any(_ != headers[0] for _ in headers):
+        columns = sorted(columns)
+    chunks = dataframe_loader(fn, sheet=sheet, **params)
+    return _index_chunks(_align_chunks(chunks, columns))
+
+
+def _load_dataframe_worker(args):
+    """
+    :load_dataframe for a single (fn, params) pair, run in a worker process
+     (daemonic, so it can't start a process pool of its own)
+    """
+    fn, params = args
+    return load_dataframe(fn, **dict(params, processes=1))
+
+
+def load_dataframe_from_files(fn, df=pd.DataFrame(), processes=None, **params):
+    """
+    Inputs:
+        + list of file names, parsed in parallel
+        + df (optional), dataframe to prepend to the result
+        + processes (optional), number of worker processes
+        + schema (optional), applied once to the concatenated dataframe
+    
+    Outputs:
+        + single pandas dataframe, concatenated once
     """ 
-    # append dataframes to df, as loaded
-    for df_i in dataframe_loader(fn, **params):
-        df = df.append(df_i, ignore_index=True)
+    if not isinstance(fn, list):
+        fn = [fn]
+    # categories differ per file, so files are read without the schema
+    schema = params.pop('schema', None)
+    workers = processes
+    if processes is None:
+        processes = min(len(fn), default_workers('cpu'))
+
+    # parse files in parallel, one file per task
+    if processes > 1:
+        logger.info("loading {} files ... (processes={})".format(
+            len(fn), processes))
+        frames = get_executor('process', workers).map(
+            _load_dataframe_worker, [(fn_i, params) for fn_i in fn], 
+            chunksize=1)
+    else:
+        frames = list(dataframe_loader(fn, **params))
+
+    # concatenate once, instead of appending per file
+    if len(df) or len(df.columns):
+        frames = [df] + frames
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    if schema is not None:
+        df = eterna_schema.apply_schema(df, schema)
     return df
 
 
@@ -127,26 +377,45 @@ def load_dataframe(fn, sheet = 'Sheet1', **params):
     """
     Inputs: 
         + single file name, or list of file names
+        + chunksize (optional), number of rows per chunk
+        + processes (optional), worker processes for multiple files
+        + cache (optional), set False to bypass the parsed-file cache
+        + sheet (optional), or fn:sheet, fn:sheet1,sheet2, fn:* for excel
+        + schema (optional), compact dtypes to apply, see schema.ETERNA_SCHEMA
     
     Outputs:
-        + pandas dataframe
+        + pandas dataframe, or an iterator of dataframes if chunksize is set
     """
+    chunksize = params.get('chunksize')
+    processes = params.pop('processes', None)
+
     if isinstance(fn, list):
-        # return single combined dataframe 
-        df = load_dataframe_from_files(fn, sheet=sheet, **params)
+        if chunksize:
+            # stream chunks from each file in turn (columns grouped, sorted)
+            return _load_file_chunks(fn, sheet=sheet, sort=True, **params)
+
+        # return single combined dataframe (schema applied once, below)
+        schema = params.pop('schema', None)
+        df = load_dataframe_from_files(fn, sheet=sheet, processes=processes,
+                                       **params)
         
         # group duplicate columns resulting from rename
         logger.warning("grouping DataFrame by columns")
         logger.warning("# columns before grouping: {}".format(len(df.columns)))
         df = df.groupby(df.columns, axis=1).first()
         logger.warning("# columns after grouping: {}".format(len(df.columns)))
+        if schema is not None:
+            df = eterna_schema.apply_schema(df, schema)
    
         return df
 
 
-    elif '*' in fn:
+    elif '*' in fn.split(':')[0]:
         # glob for files if * in fn
-        return load_dataframe_from_files(glob.glob(fn), sheet=sheet, **params)
+        if chunksize:
+            return _load_file_chunks(glob.glob(fn), sheet=sheet, **params)
+        return load_dataframe_from_files(glob.glob(fn), sheet=sheet, 
+                                         processes=processes, **params)
          
     else:
         # load dataframe for a single file
@@ -156,6 +425,14 @@ def load_dataframe(fn, sheet = 'Sheet1', **params):
    
         if 'verbose' not in params:
             params['verbose'] = False
+
+        if fn.endswith(('.xlsx', '.xls')) and (sheet == '*' or ',' in sheet):
+            # several sheets (i.e. file.xlsx:* or file.xlsx:Sheet1,Sheet2)
+            params.pop('chunksize', None)
+            df = load_excel(fn, sheets=sheet, processes=processes, **params)
+            if chunksize:
+                return _index_chunks(iter_dataframe_chunks(df, chunksize))
+            return df
     
      
         if any(fn.endswith(_) for _ in ['.csv','.tsv']):
@@ -168,26 +445,376 @@ def load_dataframe(fn, sheet = 'Sheet1', **params):
             if 'mangle_dupe_cols' not in params:
                 params['mangle_dupe_cols'] = True #False
  
-       
+        elif chunksize:
+            # excel is parsed whole, then sliced into chunks
+            params.pop('chunksize')
+
+        # compact dtypes, applied as the data is read
+        schema = params.pop('schema', None)
+        # excel file already opened for another sheet (see load_excel)
+        workbook = params.pop('workbook', None)
+
+        # check cache for previously parsed file (not for chunked reads)
+        df_cache = None
+        if params.pop('cache', True) and not chunksize and os.path.exists(fn):
+            df_cache = cache.get_dataframe_cache()
+        if df_cache is not None:
+            cache_key = df_cache.key(fn, sheet=sheet, schema=schema, **params)
+            df = df_cache.get(cache_key)
+            if df is not None:
+                return df
  
         if fn.endswith('.csv'):
             df = pd.read_csv(fn, **params)
         elif fn.endswith('.tsv'):
             df = pd.read_csv(fn, delimiter='\t', **params)
         elif fn.endswith('.xlsx') or fn.endswith('.xls'):
-            df = pd.read_excel(fn, sheet=sheet, **params)
-
+            if workbook is not None:
+                df = workbook.parse(sheet, **params)
+            else:
+                xl = pd.ExcelFile(fn)
+                if sheet not in xl.sheet_names:
+                    # default to the first sheet
+                    sheet = 0
+                df = xl.parse(sheet, **params)
+
+        if schema is not None:
+            if isinstance(df, pd.DataFrame):
+                df = eterna_schema.apply_schema(df, schema)
+            elif df is not None:
+                df = (eterna_schema.apply_schema(_, schema) for _ in df)
+
+        if chunksize:
+            if isinstance(df, pd.DataFrame):
+                df = iter_dataframe_chunks(df, chunksize)
+            return _index_chunks(df)
+        if df_cache is not None and df is not None:
+            df_cache.put(cache_key, df)
         return df
 
 
 
-def write_dataframe(df, fn, inplace=True, index=False, quoting=csv.QUOTE_ALL):
-    if index is False:
-        df.reset_index(inplace=True, drop=True)
-    #try:
-    #    df.to_csv(fn, inplace=inplace, index=index, quoting=quoting)
-    #except UnicodeEncodeError as e:
-    df.to_csv(fn, inplace=inplace, index=index, quoting=quoting, encoding='utf-8')
+class _Workbook(object):
+    """
+    :excel file shared by the sheets loaded from it, either read whole on
+     first use (pd.ExcelFile reads every sheet, whichever is wanted), or,
+     with whole=False, read one sheet at a time (i.e. in worker processes)
+    """
+
+    def __init__(self, fn, whole=True):
+        self.fn = fn
+        self.whole = whole
+        self._xl = None
+
+
+    @property
+    def xl(self):
+        if self._xl is None:
+            self._xl = pd.ExcelFile(self.fn)
+        return self._xl
+
+
+    def parse(self, sheet, **params):
+        if not self.whole:
+            return _parse_sheet(self.fn, sheet, **params)
+        if sheet not in self.xl.sheet_names:
+            # default to the first sheet
+            sheet = 0
+        return self.xl.parse(sheet, **params)
+
+
+
+def _excel_value(value):
+    """
+    :cell value as pd.ExcelFile gives it (blank '', integral floats int)
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _parse_sheet(fn, sheet, **params):
+    """
+    :parse one sheet without reading the others; .xls through xlrd
+     on_demand, .xlsx from openpyxl read-only rows (xlrd reads every sheet
+     of an .xlsx)
+    """
+    wb = _open_workbook(fn)
+    try:
+        if not fn.endswith('.xlsx'):
+            return pd.ExcelFile(wb).parse(sheet, **params)
+        ws = wb[sheet] if sheet in wb.sheetnames else wb.worksheets[0]
+        rows = [[_excel_value(v) for v in row] 
+                for row in ws.iter_rows(values_only=True)]
+    finally:
+        _close_workbook(wb)
+
+    # read-only rows may be ragged, and the sheet may end in blank rows
+    width = max([len(_) for _ in rows] or [0])
+    rows = [row + [''] * (width - len(row)) for row in rows]
+    while rows and not any(_ != '' for _ in rows[-1]):
+        rows.pop()
+    if not rows:
+        return pd.DataFrame()
+    return TextParser(rows, header=0, **params).read()
+
+
+def _open_workbook(fn):
+    """
+    :open fn without parsing its sheets (optional: openpyxl, xlrd); close
+     with _close_workbook, read-only workbooks keep the file open
+    """
+    if fn.endswith('.xlsx'):
+        import openpyxl
+        return openpyxl.load_workbook(fn, read_only=True)
+    import xlrd
+    return xlrd.open_workbook(fn, on_demand=True)
+
+
+def _close_workbook(wb):
+    if hasattr(wb, 'release_resources'):
+        # xlrd
+        wb.release_resources()
+    elif hasattr(wb, 'close'):
+        wb.close()
+    elif hasattr(wb, '_archive'):
+        # openpyxl < 2.6
+        wb._archive.close()
+
+
+def excel_sheet_names(fn):
+    """
+    :list sheet names without parsing the sheets (optional: openpyxl, xlrd)
+    """
+    try:
+        wb = _open_workbook(fn)
+    except ImportError:
+        return pd.ExcelFile(fn).sheet_names
+    try:
+        if hasattr(wb, 'sheetnames'):
+            return list(wb.sheetnames)
+        return wb.sheet_names()
+    finally:
+        _close_workbook(wb)
+
+
+def load_excel(fn, sheets=None, processes=None, **params):
+    """
+    Inputs: 
+        + excel file name
+        + sheets (optional), list or comma-separated sheet names, '*' for all
+        + processes (optional), number of worker processes, each reading
+          only its own sheets; with one, the workbook is read once and 
+          every sheet parsed from it
+    
+    Outputs:
+        + single pandas dataframe of all requested sheets
+    """
+    sheet_names = excel_sheet_names(fn)
+    if sheets is None or sheets == '*':
+        sheets = sheet_names
+    elif not isinstance(sheets, list):
+        sheets = sheets.split(',')
+    missing = [_ for _ in sheets if _ not in sheet_names]
+    if missing:
+        raise ValueError("sheets not found in {}: {}".format(fn, missing))
+
+    fns = [':'.join([fn, _]) for _ in sheets]
+    # sheets are parsed without the schema, it is applied once combined
+    schema = params.pop('schema', None)
+    if processes is None:
+        processes = min(len(fns), default_workers('cpu'))
+
+    if processes > 1:
+        # parse (and cache) sheets in parallel, one sheet per task
+        logger.info("converting {} sheets ... (processes={})".format(
+            len(fns), processes))
+        return load_dataframe_from_files(
+            fns, processes=processes, schema=schema,
+            workbook=_Workbook(fn, whole=False), **params)
+
+    # read the workbook once (only if a sheet isn't cached), parse each sheet
+    return load_dataframe_from_files(fns, processes=1, schema=schema,
+                                     workbook=_Workbook(fn), **params)
+
+
+def _load_excel_headers(fn, sheets):
+    """
+    :read the first row of each excel sheet, opening the workbook once
+     (optional: openpyxl, xlrd)
+    """
+    headers = []
+    wb = _open_workbook(fn)
+    try:
+        for sheet in sheets:
+            if fn.endswith('.xlsx'):
+                ws = wb[sheet] if sheet in wb.sheetnames else wb.worksheets[0]
+                header = []
+                for row in ws.iter_rows():
+                    header = [c.value for c in row]
+                    break
+            else:
+                if sheet in wb.sheet_names():
+                    ws = wb.sheet_by_name(sheet)
+                else:
+                    ws = wb.sheet_by_index(0)
+                header = ws.row_values(0) if ws.nrows else []
+            headers.append(header)
+    finally:
+        _close_workbook(wb)
+
+    # trailing empty cells are not columns
+    for header in headers:
+        while header and header[-1] in (None, ''):
+            header.pop()
+    return headers
+
+
+def _union_columns(headers):
+    """
+    :union of column lists, in order of appearance
+    """
+    columns, seen = [], set()
+    for c in (c for header in headers for c in header):
+        if c not in seen:
+            columns.append(c)
+            seen.add(c)
+    return columns
+
+
+def load_columns(fn, sheet = 'Sheet1', **params):
+    """
+    Inputs: 
+        + single file name, glob, or list of file names
+    
+    Outputs:
+        + list of column names, read from the header only
+    """
+    if isinstance(fn, list) or '*' in fn.split(':')[0]:
+        # union of columns, in order of appearance
+        return _union_columns(
+            load_columns(fn_i, sheet=sheet, **params)
+            for fn_i in (fn if isinstance(fn, list) else glob.glob(fn)))
+
+    if ':' in fn:
+        [fn, sheet] = fn.split(':')
+
+    if fn.endswith('.csv'):
+        return list(pd.read_csv(fn, nrows=0, **params).columns)
+    elif fn.endswith('.tsv'):
+        return list(pd.read_csv(fn, delimiter='\t', nrows=0, **params).columns)
+    elif fn.endswith('.xlsx') or fn.endswith('.xls'):
+        # union over sheets (i.e. file.xlsx:* or file.xlsx:Sheet1,Sheet2)
+        sheets = [sheet]
+        if sheet == '*':
+            sheets = excel_sheet_names(fn)
+        elif ',' in sheet:
+            sheets = sheet.split(',')
+        try:
+            return _union_columns(_load_excel_headers(fn, sheets))
+        except ImportError:
+            logger.debug("for fast excel headers, run: pip install openpyxl xlrd")
+        return _union_columns(
+            list(load_dataframe(':'.join([fn, _]), **params).columns)
+            for _ in sheets)
+    return []
+
+
+
+def open_output(fn, mode='w', compression='infer'):
+    """
+    :open fn for binary writing, compressed by extension (.gz, .zst) or
+     compression='gzip'/'zstd' (optional: zstandard)
+    """
+    if compression == 'infer':
+        compression = {'.gz': 'gzip', '.zst': 'zstd'}.get(
+            os.path.splitext(fn)[1])
+    if compression == 'gzip':
+        return gzip.open(fn, mode + 'b')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("for zstd output, run: pip install zstandard")
+        return zstandard.ZstdCompressor().stream_writer(open(fn, mode + 'b'))
+    elif compression is None:
+        return open(fn, mode + 'b')
+    raise ValueError('Invalid compression: {}'.format(compression))
+
+
+def _format_csv_chunk(args):
+    """
+    :format a chunk of rows as csv text, run in a worker
+    """
+    df, params = args
+    text = df.to_csv(None, **params)
+    if not isinstance(text, bytes):
+        text = text.encode(params.get('encoding') or 'utf-8')
+    return text
+
+
+def write_dataframe_chunks(chunks, fn, index=False, quoting=csv.QUOTE_ALL,
+                           mode='w', header=True, compression='infer', 
+                           workers=None, processes=False):
+    """
+    Inputs:
+        + iterable of dataframes, written to fn in order
+        + compression (optional), 'gzip', 'zstd', None, or 'infer' from fn
+        + workers (optional), number of chunks formatted concurrently
+        + processes (optional), format in worker processes, not threads
+
+    Outputs:
+        + number of rows written
+    """
+    if workers is None:
+        workers = default_workers('cpu')
+    params = dict(index=index, quoting=quoting, encoding='utf-8')
+
+    # bounded window of chunks being formatted, written in order
+    pool = None
+    if workers > 1:
+        pool = get_executor('process' if processes else 'thread', workers)
+    pending = collections.deque()
+    n_rows = 0
+    fid = open_output(fn, mode=mode, compression=compression)
+    try:
+        for idx, df in enumerate(chunks):
+            args = (df, dict(params, header=header if idx == 0 else False))
+            n_rows += len(df)
+            if pool is None:
+                fid.write(_format_csv_chunk(args))
+                continue
+            pending.append(pool.apply_async(_format_csv_chunk, (args,)))
+            while len(pending) >= 2 * workers:
+                fid.write(pending.popleft().get())
+            logger.debug("formatting chunk {} (rows={})".format(idx, n_rows))
+        while pending:
+            fid.write(pending.popleft().get())
+    finally:
+        fid.close()
+    return n_rows
+
+
+def write_dataframe(df, fn, inplace=True, index=False, quoting=csv.QUOTE_ALL,
+                    mode='w', header=True, compression='infer', 
+                    chunksize=50000, workers=None, processes=False):
+    """
+    Inputs:
+        + dataframe, never modified or copied as a whole
+        + fn, output file (.gz and .zst are compressed)
+        + chunksize (optional), rows per formatted chunk
+
+    Outputs:
+        + True
+    """
+    if len(df) <= chunksize:
+        workers = 1
+    write_dataframe_chunks(iter_dataframe_chunks(df, chunksize), fn, 
+                           index=index, quoting=quoting, mode=mode, 
+                           header=header, compression=compression, 
+                           workers=workers, processes=processes)
     return True
 
 
@@ -204,40 +831,176 @@ def submit_command(cmd, verbose=False):
     return o
 
 
-def map_async(func, args):
+def map_async(func, args, backend='thread', workers=None):
     """
+    :map func over args on a shared executor, return the (finished)
+     AsyncResult; use backend='process' for cpu-bound func
     """
-    ### init multiprocessing                 
     logger.info("mapping async ...")                                   
-    mp_pool = mp.Pool(64)#mp.cpu_count() - 1)
-    async_result = mp_pool.map_async(func, args)
-    mp_pool.close()
-    mp_pool.join()
+    async_result = get_executor(backend, workers).map_async(func, args)
+    async_result.wait()
     return async_result
 
 
+###############################################################################
+### json
+###############################################################################
+try:
+    import ijson
+    try:
+        # C parser (needs libyajl2), several times faster than pure python
+        import ijson.backends.yajl2_c as ijson_backend
+    except ImportError:
+        ijson_backend = ijson
+        logger.debug("for faster streaming json, install yajl 2")
+except ImportError:
+    ijson = ijson_backend = None
+    logger.debug("for streaming json, run: pip install ijson")
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkReader(object):
+    """
+    :file-like view of an iterable of text chunks, for incremental parsers;
+     with keep=True, the chunks read are kept (for replay) until forget()
+    """
+
+    def __init__(self, chunks, keep=False):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        self.kept = [] if keep else None
+
+
+    def forget(self):
+        self.kept = None
+
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            if self.kept is not None:
+                self.kept.append(chunk)
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+
+def strip_escaped_cr(chunks):
+    """
+    :drop escaped carriage returns (\\r) from a stream of text chunks
+    """
+    carry = ''
+    for chunk in chunks:
+        chunk, carry = carry + chunk, ''
+        # hold a trailing backslash, it may start a \r in the next chunk
+        if chunk.endswith('\\'):
+            chunk, carry = chunk[:-1], '\\'
+        yield chunk.replace('\\r', '')
+    if carry:
+        yield carry
+
+
+def _from_decimal(obj):
+    """
+    :ijson parses non-integer numbers as Decimal, json.loads as float
+     (converted in place, records are fresh from the parser)
+    """
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            if isinstance(v, (decimal.Decimal, dict, list)):
+                obj[k] = _from_decimal(v)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            if isinstance(v, (decimal.Decimal, dict, list)):
+                obj[i] = _from_decimal(v)
+    return obj
+
+
+def iter_json(jsondata, keys=[]):
+    """
+    Inputs:
+        + json text, a file-like object, or an iterable of text chunks
+        + keys, path to the records (i.e. ['data', 'solutions'])
+
+    Outputs:
+        + generator of the records under keys, parsed incrementally
+          (with ijson, otherwise the response is decoded all at once);
+          anything but a list under keys is a single record, and nothing
+          is yielded when keys are missing
+    """
+    if isinstance(jsondata, basestring):
+        chunks = [jsondata]
+    elif hasattr(jsondata, 'read'):
+        chunks = iter(lambda: jsondata.read(JSON_CHUNK_SIZE), '')
+    else:
+        chunks = jsondata
+    chunks = strip_escaped_cr(chunks)
+
+    if ijson is not None:
+        # stream the items of a list under keys (the usual case), keeping
+        # what was read only until the first item arrives
+        prefix = '.'.join(map(str, keys))
+        reader = _ChunkReader(chunks, keep=True)
+        for record in ijson_backend.items(
+                reader, '.'.join(filter(None, [prefix, 'item']))):
+            reader.forget()
+            yield _from_decimal(record)
+        if reader.kept is None:
+            return
+
+        # no items, look again for anything else under keys
+        events = ijson_backend.parse(_ChunkReader(reader.kept))
+        for event in events:
+            if event[0] == prefix:
+                break
+        else:
+            return
+        if event[1] != 'start_array':
+            events = itertools.chain([event], events)
+            for record in itertools.islice(
+                    ijson.common.items(events, prefix), 1):
+                yield _from_decimal(record)
+        return
+
+    d = json.loads(''.join(chunks))
+    try:
+        for key in keys:
+            d = d[key]
+    except (KeyError, IndexError, TypeError):
+        return
+    for record in (d if isinstance(d, list) else [d]):
+        yield record
+
+
 def load_json(jsondata, async=False, keys=[]):
     """
+    :decode each response, return the object under keys per response (as
+     far as keys could be followed); see iter_json to stream records
+
+     jsondata may be an AsyncResult (async=True) or any iterable of
+     responses
     """
+    if async is True and hasattr(jsondata, 'get'):
+        jsondata = jsondata.get()
     data = []
-    if async is True:   
-        for d in jsondata.get():
-            d = json.loads(d.replace('\\r', ''))
-            try:
-                for key in keys:
-                    d = d[key]
-            except:            
-                pass
-            data.append(d)
-    else:
-        for idx, d in enumerate(jsondata):
-            d = json.loads(d.replace('\\r', ''))
-            try:
-                for key in keys:
-                    d = d[key]
-            except:            
-                pass
-            data.append(d)
+    for d in jsondata:
+        d = json.loads(d.replace('\\r', ''))
+        try:
+            for key in keys:
+                d = d[key]
+        except (KeyError, IndexError, TypeError):
+            pass
+        data.append(d)
     return data
 
 
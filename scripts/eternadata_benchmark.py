@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger( __name__ )
+
+import eternadata.util as util
+import eternadata.cache as cache
+import eternadata.scheduler as scheduler
+import eternadata.fetch as fetch
+
+import eternadata_fake_api as fake_api
+import eternadata_fusiontables_util as ft_util_script
+import eternadata_fusiontables_meta as ft_meta_script
+
+
+###############################################################################
+### helpers
+###############################################################################
+class RequestTimer(object):
+    """
+    :record the latency (time to response headers, including rate limit
+     waits and retries) and outcome of every fetch request, while active
+    """
+
+    def __init__(self):
+        self.latencies, self.errors = [], 0
+        self._lock = threading.Lock()
+        self._get = None
+
+
+    def __enter__(self):
+        self._get = get = fetch._get
+        def timed_get(*args, **kwds):
+            start = time.time()
+            try:
+                return get(*args, **kwds)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    self.latencies.append(time.time() - start)
+        fetch._get = timed_get
+        return self
+
+
+    def __exit__(self, *exc_info):
+        fetch._get = self._get
+        return False
+
+
+
+def summarize(name, elapsed, timer, server):
+    """
+    :return a row of throughput and latency stats
+    """
+    latencies = np.array(timer.latencies or [np.nan]) * 1000.
+    n = len(timer.latencies)
+    return {'phase': name, 'seconds': round(elapsed, 3),
+            'requests': n, 'served': server.requests,
+            'errors': timer.errors,
+            'req/s': round(n / elapsed, 1) if elapsed else np.nan,
+            'p50_ms': round(np.percentile(latencies, 50), 1),
+            'p90_ms': round(np.percentile(latencies, 90), 1),
+            'p99_ms': round(np.percentile(latencies, 99), 1),
+            'max_ms': round(np.max(latencies), 1)}
+
+
+
+def run_phase(name, func, server):
+    server.requests = 0
+    with RequestTimer() as timer:
+        start = time.time()
+        try:
+            func()
+        except Exception as e:
+            logger.error("{} failed: {}".format(name, e))
+        elapsed = time.time() - start
+    return summarize(name, elapsed, timer, server)
+
+
+
+###############################################################################
+### benchmarks
+###############################################################################
+def bench_query_eterna_data(options, source):
+    """
+    :FusionUtil.query_eterna_data over every design in source
+    """
+    fu_options = argparse.Namespace(
+        mode='query', source=source, target=None, outfile=None,
+        column_file=None, cloud_round=None, tableID=None, token=None,
+        csv=False, verbose=False, debug=False, dry=True, chunksize=None,
+        concurrency=options.concurrency, batch_size=options.batch_size)
+    # query_eterna_data prints its frames
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        ft_util_script.FusionUtil(fu_options).query_eterna_data()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def bench_get_nstates(options, project_ids):
+    """
+    :eternadata_fusiontables_meta.get_nstates over every project
+    """
+    ft_meta_script.get_nstates(project_ids)
+
+
+
+###############################################################################
+### scripting
+###############################################################################
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Eterna fetch throughput benchmark (against a fake api)')
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--puzzles', type=int, default=5,
+                        help="puzzles per project")
+    parser.add_argument('--solutions', type=int, default=20,
+                        help="solutions per puzzle")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="median seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help="lognormal sigma of the latency")
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0.0, help="fraction of 503 responses")
+    parser.add_argument('--throttle-rate', dest='throttle_rate', type=float,
+                        default=0.0, help="fraction of 429 responses")
+    parser.add_argument('--no-batching', dest='batching',
+                        action='store_false', help="api rejects multi-id requests")
+    parser.add_argument('--concurrency', type=int, default=fetch.CONCURRENCY)
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        default=fetch.BATCH_SIZE)
+    parser.add_argument('--rate', type=float, default=None,
+                        help="max requests per second, per host "
+                             "(default: none, slowed down only on 429)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cache', action='store_true',
+                        help="keep the response cache on (off by default)")
+    parser.add_argument('-o', '--outfile', default=None,
+                        help="write results as csv")
+    parser.add_argument('-l', '--log', default='ERROR')
+    options = parser.parse_args()
+
+    util.configure_logging(level=options.log.upper())
+    tmpdir = tempfile.mkdtemp(prefix='eternadata_bench_')
+    cache.configure_cache(enabled=options.cache,
+                          directory=os.path.join(tmpdir, 'cache'))
+    scheduler.configure_scheduler(rate=options.rate)
+
+    # fake api, and a source of every design it knows
+    data = fake_api.FakeEternaData(
+        options.projects, options.puzzles, options.solutions)
+    server = fake_api.FakeEternaServer(
+        data=data, latency=options.latency, jitter=options.jitter,
+        error_rate=options.error_rate, throttle_rate=options.throttle_rate,
+        batching=options.batching).start()
+    fetch.ETERNA_GET_URL = server.url
+    source = os.path.join(tmpdir, 'source.csv')
+    pd.DataFrame(list(data.designs()),
+                 columns=['Design_ID', 'Puzzle_Name']).assign(
+                    Synthesis_Round='1').to_csv(source, index=False)
+    logger.info("fake api at {} (source={})".format(server.url, source))
+
+    results = []
+    try:
+        for run in range(options.repeat):
+            for name, func, args in [
+                    ('query_eterna_data', bench_query_eterna_data, source),
+                    ('get_nstates', bench_get_nstates, data.project_ids())]:
+                row = run_phase(name, lambda: func(options, args), server)
+                row['run'] = run
+                results.append(row)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    columns = ['phase', 'run', 'seconds', 'requests', 'served', 'errors',
+               'req/s', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+    results = pd.DataFrame(results, columns=columns)
+    print results.to_string(index=False)
+    if options.outfile:
+        results.to_csv(options.outfile, index=False)
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import random
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import logging
+logger = logging.getLogger( __name__ )
+
+
+###############################################################################
+### globals
+###############################################################################
+PROJECT_NID = 1000000
+PUZZLE_NID = 5000000
+DESIGN_NID = 7000000
+
+# select_as fields of type=solutions, by eterna field name
+SOLUTION_FIELDS = {
+    'n.nid': lambda s: s['design'],
+    'puz.field_puzzle_lab_project_nid': lambda s: s['project'],
+    'puz.nid': lambda s: s['puzzle'],
+    'nr.body': lambda s: 'synthetic design {}'.format(s['design']),
+    'u.uid': lambda s: s['designer'],
+}
+
+
+###############################################################################
+### synthetic data
+###############################################################################
+class FakeEternaData(object):
+    """
+    :deterministic projects -> puzzles -> solutions, i.e. with the
+     defaults, project 1000001 has puzzles 5000100..5000104, and puzzle
+     5000100 has solutions 7100000..7100019
+    """
+
+    def __init__(self, projects=10, puzzles=5, solutions=20):
+        self.n_projects = projects
+        self.n_puzzles = puzzles
+        self.n_solutions = solutions
+
+
+    def project_ids(self):
+        return [PROJECT_NID + i for i in range(self.n_projects)]
+
+
+    def puzzle_ids(self, project_id):
+        i = project_id - PROJECT_NID
+        if not 0 <= i < self.n_projects:
+            return []
+        return [PUZZLE_NID + i * 100 + j for j in range(self.n_puzzles)]
+
+
+    def solution(self, design_id):
+        """
+        :return solution dict for design_id, or None
+        """
+        puzzle_idx, k = divmod(design_id - DESIGN_NID, 1000)
+        i, j = divmod(puzzle_idx, 100)
+        if not (0 <= i < self.n_projects and 0 <= j < self.n_puzzles and
+                0 <= k < self.n_solutions):
+            return None
+        return {'design': design_id, 'project': PROJECT_NID + i,
+                'puzzle': PUZZLE_NID + i * 100 + j,
+                'designer': 100 + design_id % 37}
+
+
+    def puzzle_solutions(self, puzzle_id):
+        i, j = divmod(puzzle_id - PUZZLE_NID, 100)
+        if not (0 <= i < self.n_projects and 0 <= j < self.n_puzzles):
+            return []
+        return [self.solution(DESIGN_NID + (i * 100 + j) * 1000 + k)
+                for k in range(self.n_solutions)]
+
+
+    def designs(self):
+        """
+        :yield (Design_ID, Puzzle_Name) for every solution, i.e. a --source
+        """
+        for project_id in self.project_ids():
+            for puzzle_id in self.puzzle_ids(project_id):
+                for s in self.puzzle_solutions(puzzle_id):
+                    yield (s['design'], 'Puzzle {}'.format(puzzle_id))
+
+
+    def project(self, project_id):
+        puzzles = []
+        for puzzle_id in self.puzzle_ids(project_id):
+            puzzle = {'nid': str(puzzle_id),
+                      'title': 'Puzzle {}'.format(puzzle_id),
+                      'constraints': 'SHAPE,0,SHAPE,1'}
+            # every other puzzle is a switch puzzle
+            if puzzle_id % 2:
+                puzzle['switch_struct'] = ['((((....))))', '............']
+            puzzles.append(puzzle)
+        return {'data': {'lab': {
+            'title': 'Project {} - Round 2'.format(project_id),
+            'puzzles': [{'round': '2', 'puzzles': puzzles}]}}}
+
+
+    def solutions(self, query):
+        fields = query.get('fields', '').split(',')
+        names = query.get('select_as', '').split(',')
+        if 'solnid' in query:
+            sols = [self.solution(_) for _ in _ids(query['solnid'])]
+        else:
+            sols = [s for _ in _ids(query.get('puznid', ''))
+                    for s in self.puzzle_solutions(_)]
+        records = [dict((name, str(SOLUTION_FIELDS[field](s))
+                         if field in SOLUTION_FIELDS else '')
+                        for field, name in zip(fields, names))
+                   for s in sols if s is not None]
+        return {'data': {'solutions': records}}
+
+
+
+def _ids(value):
+    return [int(_) for _ in value.split(',') if _.strip().isdigit()]
+
+
+
+###############################################################################
+### server
+###############################################################################
+class FakeEternaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        server.count()
+
+        # latency, with a long (lognormal) tail
+        if server.latency:
+            time.sleep(server.latency * random.lognormvariate(0, server.jitter))
+
+        # injected failures
+        roll = random.random()
+        if roll < server.throttle_rate:
+            return self._send(429, {'error': 'throttled'},
+                              {'Retry-After': '1'})
+        if roll < server.throttle_rate + server.error_rate:
+            return self._send(503, {'error': 'unavailable'})
+
+        ids = query.get('solnid') or query.get('puznid') or ''
+        if not server.batching and ',' in ids:
+            return self._send(400, {'error': 'one id per request'})
+
+        if url.path.rstrip('/') != '/get':
+            return self._send(404, {'error': 'not found'})
+        if query.get('type') == 'solutions':
+            return self._send(200, server.data.solutions(query))
+        if query.get('type') == 'project':
+            try:
+                project_id = int(query.get('nid'))
+            except (TypeError, ValueError):
+                return self._send(400, {'error': 'bad nid'})
+            return self._send(200, server.data.project(project_id))
+        return self._send(400, {'error': 'unknown type'})
+
+
+    def _send(self, status, body, headers={}):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+
+
+class FakeEternaServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    :stand-in for staging.eternagame.org/get/ (type=solutions, type=project)
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    # the default backlog (5) drops connections under concurrent load,
+    # adding seconds-long SYN retries to the measured latencies
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0, data=None, latency=0.0,
+                 jitter=0.5, error_rate=0.0, throttle_rate=0.0, batching=True):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, (host, port), FakeEternaHandler)
+        self.data = data or FakeEternaData()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.batching = batching
+        self.requests = 0
+        self._lock = threading.Lock()
+
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+    @property
+    def url(self):
+        return 'http://{}:{}/get/'.format(*self.server_address)
+
+
+    def start(self):
+        """
+        :serve in a background thread, return self
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+
+###############################################################################
+### scripting
+###############################################################################
+if __name__=="__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Fake Eterna API (staging.eternagame.org/get/)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--puzzles', type=int, default=5,
+                        help="puzzles per project")
+    parser.add_argument('--solutions', type=int, default=20,
+                        help="solutions per puzzle")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="median seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help="lognormal sigma of the latency")
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0.0, help="fraction of 503 responses")
+    parser.add_argument('--throttle-rate', dest='throttle_rate', type=float,
+                        default=0.0, help="fraction of 429 responses")
+    parser.add_argument('--no-batching', dest='batching',
+                        action='store_false', help="reject multi-id requests")
+    parser.add_argument('-l', '--log', default='INFO')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=options.log.upper())
+    server = FakeEternaServer(
+        options.host, options.port,
+        data=FakeEternaData(options.projects, options.puzzles,
+                            options.solutions),
+        latency=options.latency, jitter=options.jitter,
+        error_rate=options.error_rate, throttle_rate=options.throttle_rate,
+        batching=options.batching)
+    logger.info("serving fake eterna api at {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -20,6 +20,10 @@ import logging
 logger = logging.getLogger( __name__ )
 
 import eternadata.util as util
+import eternadata.cache as cache
+import eternadata.scheduler as scheduler
+import eternadata.schema as schema
+import eternadata.fetch as fetch
 import eternadata.fusiontables.client as ft_client
 import eternadata.fusiontables.util as ft_util
 
@@ -41,18 +45,100 @@ def get_unique(s):
     return s
     
 def format_ID_columns(df):
-    for c in df.columns:
-        if not c.endswith('ID'):
-            continue
+    return schema.normalize_ids(df, ['*ID'])
+
+def project_states(d):
+    """
+    :return {puzzle id: state count} from a type=project response
+    """
+    n_states = {}
+    project = d['data']['lab']
+    puzzles = project['puzzles'][0]['puzzles']
+    for puz in puzzles:
+        #logger.warn("{}:\n{}".format(puz['title'],pprint.pformat(puz)))
+        puznid = int(puz['nid'])
         try:
-            df[c] = df[c].astype(int)
-        except Exception as e:
-            logger.error("df[{}].astype(int) failed\n(error={})".format(c,e))
-            logger.debug(pprint.pformat(df))
-            df.info()
-            logger.error(df[df['c']==''])
+            csts, structs = puz['constraints'], puz['switch_struct']
+            n_states[puznid] = len(structs)
+        except:
+            csts, structs = puz['constraints'], []
+            n_states[puznid] = csts.count('SHAPE')-csts.count('ANTISHAPE')
+        if type(n_states[puznid]) in [list, tuple]:
+            n_states[puznid] = n_states[puznid][0]
+
+        logger.debug("{:15}:\tstate_count: {}\n csts:\t{}\n switch_structs:\t{}"
+                    .format(puz['title'], n_states[puznid], csts, structs))
+        logger.warn("{:15}:\tstate_count: {}\t(n_shapes: {}, n_structs: {})".format(
+            puz['title'], n_states[puznid],
+            csts.count('SHAPE') - csts.count('ANTISHAPE'),
+            len(structs)
+        ))
+    logger.debug("N States = " + str(n_states))
+    return n_states
+
+
+class ProjectStateResolver(object):
+    """
+    :fetch the puzzle state counts of many projects concurrently, keeping
+     results (and failures) across calls; a failing project only loses
+     the state counts of its own puzzles
+    """
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency
+        self.states = {}    # {project id: {puzzle id: state count}}
+        self.failed = {}    # {project id: error}
+
+
+    def resolve(self, project_ids, retry_failed=True):
+        """
+        :return {puzzle id: state count} for the puzzles of each project
+        """
+        if type(project_ids) != list:
+            project_ids = [project_ids]
+        ids = []
+        for project_id in project_ids:
+            try:
+                ids.append(int(project_id))
+            except (TypeError, ValueError) as e:
+                # blank or malformed (i.e. '' with na_filter=False), skip it
+                if not pd.isnull(project_id) and project_id != '':
+                    self.failed[project_id] = e
+                    logger.error("project {!r}: {}".format(project_id, e))
+        project_ids = ids
+        todo = set(_ for _ in project_ids if _ not in self.states and
+                   (retry_failed or _ not in self.failed))
+
+        if todo:
+            logger.info("resolving state counts of {} projects".format(len(todo)))
+            with fetch.FetchPool(limit=self.concurrency) as pool:
+                for project_id in todo:
+                    pool.submit(fetch.eterna_url('project', nid=project_id),
+                                tag=project_id)
+                for project_id, url, d, error in pool.as_completed():
+                    if error is None:
+                        try:
+                            self.states[project_id] = project_states(d)
+                            self.failed.pop(project_id, None)
+                            continue
+                        except Exception as e:
+                            error = e
+                    # skip this project, its puzzles get no State_Count
+                    self.failed[project_id] = error
+                    logger.error("project {}: {}".format(project_id, error))
+
+        n_states = {}
+        for project_id in project_ids:
+            n_states.update(self.states.get(project_id, {}))
+        return n_states
+
 
-    return df
+
+def get_nstates(project_ids):
+    """
+    :return {puzzle id: state count} for the puzzles of each project
+    """
+    return ProjectStateResolver().resolve(project_ids)
 
 ###############################################################################
 ### main
@@ -66,23 +152,38 @@ class MetaDataFusionTableFlow():
         
         self.options = self._validate_options(options)
 
-        self.ft_client = ft_client.FTClientOAuth2()
+        self._ft_client = None
 
         self.df, self.df_cache = None, {}
 
         self.fn_cache = {}
+
+        # state counts per project, kept across run_flow calls
+        self.state_resolver = ProjectStateResolver(
+            concurrency=self.options.concurrency)
   
         self.table_name, self.table_map = None, {}
         self._tableFlow = None
 
         # inti source df
         source_df = util.load_dataframe(self.options.source, 
-                                        na_filter=False)
+                                        na_filter=False,
+                                        schema=schema.ETERNA_SCHEMA)
         self.df_cache[self.options.source] = source_df
    
      
   
 
+    @property
+    def ft_client(self):
+        """
+        :fusion tables client, authorized on first use
+        """
+        if self._ft_client is None:
+            self._ft_client = ft_client.get_client()
+        return self._ft_client
+
+
     def _validate_options(self, options):
         self.logger.debug('(options={})'.format(pprint.pformat(options)))
         return options
@@ -237,46 +338,8 @@ class MetaDataFusionTableFlow():
         self.logger.debug(pprint.pformat(meta))
       
 
-        ### TODO: hacky...                                                                                                                                                                    
-        def get_nstates(project_ids):
-            if type(project_ids) != list:
-                project_ids = [project_ids]
-            n_states = {}
-            for project_id in project_ids:
-                curl_cmd = "curl '{}'".format(
-                    "http://staging.eternagame.org/get/?type=project&nid={}"
-                    .format(project_id))
-                o = util.submit_command(curl_cmd, verbose=False)
-                d = json.loads(o, encoding='utf-8')
-                try:
-                    project = d['data']['lab']
-                    puzzles = project['puzzles'][0]['puzzles']
-                    for puz in puzzles:
-                        #logger.warn("{}:\n{}".format(puz['title'],pprint.pformat(puz)))
-                        puznid = int(puz['nid'])
-                        try:
-                            csts, structs = puz['constraints'], puz['switch_struct']
-                            n_states[puznid] = len(structs)
-                        except:
-                            csts, structs = puz['constraints'], []
-                            n_states[puznid] = csts.count('SHAPE')-csts.count('ANTISHAPE')
-                        if type(n_states[puznid]) in [list, tuple]:
-                            n_states[puznid] = n_states[puznid][0]
-
-                        logger.debug("{:15}:\tstate_count: {}\n csts:\t{}\n switch_structs:\t{}"
-                                    .format(puz['title'], n_states[puznid], csts, structs))
-                        logger.warn("{:15}:\tstate_count: {}\t(n_shapes: {}, n_structs: {})".format(
-                            puz['title'], n_states[puznid],
-                            csts.count('SHAPE') - csts.count('ANTISHAPE'),
-                            len(structs)
-                        ))
-                    self.logger.debug("N States = " + str(n_states))
-                except Exception as e:
-                    self.logger.error(e)
-                    exit()
-            return n_states
-
-        puzzle_states = get_nstates(list(source_df.Project_ID.unique())) 
+        puzzle_states = self.state_resolver.resolve(
+            list(source_df.Project_ID.unique()))
         logger.debug('State_Counts:\n{}'.format(pprint.pformat(puzzle_states)))
          
         for Puzzle_ID in set(source_df.index):  
@@ -294,7 +357,7 @@ class MetaDataFusionTableFlow():
             except Exception as e:
                 logger.warn("error: {}".format(e))
                 logger.warn("puzzle_states: {}".format(puzzle_states))
-                exit()#meta['State_Count']  += [2]
+                meta['State_Count'] += [None]
         
         self.logger.debug(pprint.pformat(zip(*map(meta.get, fields))))
         self.df = pd.DataFrame(zip(*map(meta.get, fields)), 
@@ -498,10 +561,21 @@ if __name__=="__main__":
     parser.add_argument('-o', '--outfile', default=None)
     parser.add_argument('-u', '--upload', default=False, action='store_true')
     parser.add_argument('-l', '--log', default='INFO')
+    parser.add_argument('--concurrency', type=int, default=fetch.CONCURRENCY,
+                        help="max eterna requests in flight")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="max requests per second, per host "
+                             "(default: none, slowed down only on 429)")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="don't read/write the parsed-file and response caches")
+    parser.add_argument('--cache-ttl', dest='cache_ttl', type=float, default=None,
+                        help="seconds to reuse cached eterna responses")
     options = parser.parse_args()
   
     # init log levels
     util.configure_logging(level=options.log.upper())
+    cache.configure_cache(enabled=options.cache, response_ttl=options.cache_ttl)
+    scheduler.configure_scheduler(rate=options.rate)
     
     # script-specific imports
     """
@@ -19,6 +19,12 @@ import logging
 
 
 import eternadata.util as util
+import eternadata.cache as cache
+import eternadata.scheduler as scheduler
+import eternadata.schema as schema
+import eternadata.merge as merge
+import eternadata.fetch as fetch
+import eternadata.metrics as metrics
 
 import eternadata.fusiontables.client as ft_client
 import eternadata.fusiontables.util as ft_util
@@ -34,32 +40,66 @@ logger= logging.getLogger( __name__ )
 ###############################################################################
 ### helpers
 ###############################################################################
-def fixup_fusion_columns(df):
-    
+# rename rules and compiled rename plans, built once per process
+_rename_rules = {}
+_rename_plans = {}
+
+
+def load_rename_rules():
+    """
+    :load replacements (substrings) and conversions (exact names) once
+    """
+    # TODO: allow user to specify list of replacements, conversions
+    if not _rename_rules:
+        fn = os.path.join(__dir__, "johan_fusion_replacements.csv") 
+        _rename_rules['replacements'] = map(
+            tuple, util.load_dataframe(fn, cache=False).values)
+        # convert from CamelCase to Camel_Case
+        fn = os.path.join(__dir__, "johan_fusion_conversions.csv") 
+        _rename_rules['conversions'] = dict(map(
+            tuple, util.load_dataframe(fn, cache=False).values))
+    return _rename_rules
+
+
+def fixup_fusion_column(c, rules=None):
+    """
+    :apply every rename step to a single column name
+    """
+    if rules is None:
+        rules = load_rename_rules()
+    if not isinstance(c, basestring):
+        return c
+
     # make replacements
-    # TODO: allow user to specify list of replacements
-    fn = os.path.join(__dir__, "johan_fusion_replacements.csv") 
-    replacements = map(tuple, util.load_dataframe(fn).values) 
-    for (key, val) in replacements:
-        columns_replaced = dict(
-            (c, c.replace(key, val)) for c in df.columns if key in c)
-        df.rename(columns = columns_replaced, inplace=True)
-    
+    for (key, val) in rules['replacements']:
+        if key in c:
+            c = c.replace(key, val)
 
     # remove trailing _
-    df = df.rename(columns = dict(
-        (c, c[:-1]) for c in df.columns if c.endswith('_')))
-    df = df.rename(columns = dict(
-        (c, c.replace('__', '_')) for c in df.columns if '__' in c))
-    df = df.rename(columns = dict(
-        (c, c.replace('err', 'sem')) for c in df.columns if 'err' in c))    
-
-    # TODO: allow user to specify list of conversions
+    if c.endswith('_'):
+        c = c[:-1]
+    c = c.replace('__', '_')
+    c = c.replace('err', 'sem')
+
     # convert from CamelCase to Camel_Case
-    fn = os.path.join(__dir__, "johan_fusion_conversions.csv") 
-    conversions =  dict(map(tuple, util.load_dataframe(fn).values))
-    df.rename(columns = conversions, inplace = True)
-    
+    return rules['conversions'].get(c, c)
+
+
+def compile_rename_plan(columns):
+    """
+    :map old -> new column names, compiled once per set of columns
+    """
+    key = tuple(columns)
+    if key not in _rename_plans:
+        rules = load_rename_rules()
+        plan = dict((c, fixup_fusion_column(c, rules)) for c in key)
+        _rename_plans[key] = dict(
+            (old, new) for old, new in plan.iteritems() if old != new)
+    return _rename_plans[key]
+
+
+def fixup_fusion_columns(df):
+    df.rename(columns=compile_rename_plan(df.columns), inplace=True)
     return df
 
 
@@ -80,7 +120,20 @@ class FusionUtil():
         self.df_map = {}
         self.df = None 
 
-        self.ft_client = ft_client.FTClientOAuth2(self.options.tableID)
+        # column names per source, probed once per process
+        self._columns_cache = {}
+
+        self._ft_client = None
+
+
+    @property
+    def ft_client(self):
+        """
+            fusion tables client, authorized on first use
+        """
+        if self._ft_client is None:
+            self._ft_client = ft_client.get_client(self.options.tableID)
+        return self._ft_client
 
 
     def _validate_options(self, options):
@@ -129,25 +182,71 @@ class FusionUtil():
 
 
 
+    def _load_source_chunks(self, fn=None):
+        """
+            iterate over --source in chunks of --chunksize rows
+        """
+        if fn is None:
+            fn = self.options.source
+        return util.load_dataframe(fn, chunksize=self.options.chunksize,
+                                   schema=schema.ETERNA_SCHEMA)
+
+
+    def _write_chunks(self, chunks):
+        """
+            stream chunks to --outfile, return (empty) frame with columns
+        """
+        columns = []
+        def _track_columns(chunks):
+            for df in chunks:
+                columns[:] = list(df.columns)
+                yield df
+        chunks = _track_columns(chunks)
+        if self.options.outfile:
+            util.write_dataframe_chunks(chunks, self.options.outfile)
+        else:
+            for _ in chunks:
+                pass
+        return pd.DataFrame([], columns=columns)
+
+
     def process_data(self):
         """
             load --source, write --outfile
         """
-        self.df = util.load_dataframe(self.options.source)
+        if self.options.chunksize:
+            self.df = self._write_chunks(self._load_source_chunks())
+            return self.df
+
+        self.df = util.load_dataframe(self.options.source,
+                                      schema=schema.ETERNA_SCHEMA)
         if self.options.outfile:
             util.write_dataframe(self.df, self.options.outfile)
         return self.df
 
 
+    def _load_columns(self, fn):
+        """
+            column names of fn, read from the header once per process
+        """
+        key = tuple(fn) if isinstance(fn, list) else fn
+        if key not in self._columns_cache:
+            self._columns_cache[key] = util.load_columns(fn)
+        return self._columns_cache[key]
+
+
     def get_columns(self):
         """
         """
         if self.options.column_file:
-            self.df = util.load_dataframe(self.options.column_file)
+            columns = self._load_columns(self.options.column_file)
         else:
-            coldata = self.ft_client.Table().list_columns()
-            columns = [_.get('name') for _ in coldata]
-            self.df = pd.DataFrame([], columns=columns)
+            key = ('fusiontables', self.options.tableID)
+            if key not in self._columns_cache:
+                self._columns_cache[key] = [
+                    _.get('name') for _ in self.ft_client.Table().iter_columns()]
+            columns = self._columns_cache[key]
+        self.df = pd.DataFrame([], columns=columns)
 
         if self.options.outfile:
             util.write_dataframe(self.df, self.options.outfile)
@@ -159,7 +258,7 @@ class FusionUtil():
         verify columns ...
         """
         try:
-            source_cols = util.load_dataframe(self.options.source).columns
+            source_cols = self._load_columns(self.options.source)
             fusion_cols = self.get_columns().columns
             assert(len(source_cols) and len(fusion_cols))
         except Exception as e:
@@ -187,20 +286,37 @@ class FusionUtil():
         columns_missing = self.verify_columns().columns
         columns_valid = self.get_columns().columns
 
-        self.df = util.load_dataframe(self.options.source)
-        if len(columns_missing):
-            self.df = fixup_fusion_columns(self.df)
-            if self.options.verbose:
-                print ','.join(['"{}"'.format(_) for _ in columns_missing])
-        # if this fails, make sure xlsx has Design_ID and Design_Name
-        self.df = self.df.reindex(columns=columns_valid)
-       
-        # remove controls?
-        Design_ID_strlen = self.df.Design_ID.astype(str).str.len()
-        Design_ID_valid = Design_ID_strlen.eq(Design_ID_strlen.max())
-        self.logger.info("Dropping controls from DataFrame: {}".format(
-            pprint.pformat(self.df[~Design_ID_valid])))
-        self.df = self.df[Design_ID_valid]
+        def _fixup(df):
+            if len(columns_missing):
+                df = fixup_fusion_columns(df)
+            # if this fails, make sure xlsx has Design_ID and Design_Name
+            return df.reindex(columns=columns_valid)
+
+        def _drop_controls(df, strlen_max):
+            # remove controls?
+            Design_ID_strlen = df.Design_ID.astype(str).str.len()
+            Design_ID_valid = Design_ID_strlen.eq(strlen_max)
+            self.logger.info("Dropping controls from DataFrame: {}".format(
+                pprint.pformat(df[~Design_ID_valid])))
+            return df[Design_ID_valid]
+
+        if len(columns_missing) and self.options.verbose:
+            print ','.join(['"{}"'.format(_) for _ in columns_missing])
+
+        if self.options.chunksize:
+            # first pass finds the Design_ID length, second pass writes
+            strlen_max = max(
+                _fixup(df).Design_ID.astype(str).str.len().max()
+                for df in self._load_source_chunks())
+            self.df = self._write_chunks(
+                _drop_controls(_fixup(df), strlen_max)
+                for df in self._load_source_chunks())
+            return self.df
+
+        self.df = _fixup(util.load_dataframe(self.options.source,
+                                             schema=schema.ETERNA_SCHEMA))
+        self.df = _drop_controls(
+            self.df, self.df.Design_ID.astype(str).str.len().max())
         
         if self.options.outfile:
             util.write_dataframe(self.df, self.options.outfile)
@@ -211,44 +327,69 @@ class FusionUtil():
         """
         """
         self.df = self.verify_columns()
-        self.ft_client.Table().insert_columns(self.df.columns)
+        # column types from a sample of the source
+        try:
+            sample = next(iter(util.load_dataframe(
+                self.options.source, chunksize=1000,
+                schema=schema.ETERNA_SCHEMA)))
+            types = ft_util.column_types(sample)
+        except Exception as e:
+            self.logger.warning("typing columns as NUMBER ({})".format(e))
+            types = {}
+        self.ft_client.Table().insert_columns(
+            list(self.df.columns), types=types)
         return self.df
 
 
+    def _transfer_fixups(self, df):
+        """
+            fixups applied to transferred rows before writing
+        """
+        # ids, Sequence_Length, Synthesis_Round
+        df = schema.normalize_eterna_frame(
+            df, cloud_round=self.options.cloud_round)
+ 
+        # replacements
+        df.replace({'"': '&quot;', 'NULL': ''}, regex=False)
+        return df
+
+
     #### TODO: Hacky... needs some refactoring 
     def transfer_columns(self):
  
+        if self.options.chunksize:
+            # out-of-core: only chunks of --source/--target are in memory
+            target_df = next(iter(util.load_dataframe(
+                self.options.target, chunksize=1)), None)
+            if target_df is not None and len(target_df):
+                chunks = merge.merge_update(
+                    self.options.source, self.options.target, 
+                    key='Design_ID', chunksize=self.options.chunksize)
+            else:
+                columns = self._load_columns(self.options.target)
+                chunks = (source_df.reindex(columns=columns)
+                          for source_df in self._load_source_chunks())
+            self.df = self._write_chunks(
+                self._transfer_fixups(df) for df in chunks)
+            return self.df
+
         # input file stuff
-        source_df = util.load_dataframe(self.options.source)
-        target_df = util.load_dataframe(self.options.target)
-    
-        ### join
+        target_df = util.load_dataframe(self.options.target,
+                                        schema=schema.ETERNA_SCHEMA)
+
+        source_df = util.load_dataframe(self.options.source,
+                                        schema=schema.ETERNA_SCHEMA)
+
+        ### join (on Design_ID, as merge_update does for chunks)
         self.df = pd.DataFrame()
         if len(target_df):
-            self.df = target_df.copy()
-            self.df.update(source_df)
+            self.df = merge.update_frame(target_df, source_df, key='Design_ID')
         else:
             self.df = source_df.copy()
             self.df = self.df.reindex(columns=target_df.columns)
        
         ### fixups
-        # ensure ids are ints
-        int_cols = ["Project_ID", "Project_Round", 
-                    "Puzzle_ID",  "Puzzle_Round", 
-                    "Design_ID", "Designer_ID"]
-        for int_col in int_cols:
-            self.df[int_col] = self.df[int_col].map(
-                lambda _: "{:.0f}".format(_) if '.' in str(_) else _)
-
-        # column replacements
-        self.df['Sequence_Length'] = self.df['Sequence'].map(
-            lambda _: type(_) if type(_) != str else len(_.strip()))
-        if self.options.cloud_round:
-            self.df['Synthesis_Round'] = self.df['Synthesis_Round'].map(
-                lambda _: _ if _.isdigit() else self.options.cloud_round)
- 
-        # replacements
-        self.df.replace({'"': '&quot;', 'NULL': ''}, regex=False)
+        self.df = self._transfer_fixups(self.df)
     
         if self.options.verbose:
             print self.df
@@ -271,14 +412,11 @@ class FusionUtil():
                      '__EMPTY_FIELD__', 'puz.nid', '__EMPTY_FIELD__', 
                      'nr.body', '__EMPTY_FIELD__', 'u.uid'] 
 
-        def _format_curl(nid, nid_type='solnid'):
-            url = str("http://staging.eternagame.org/get/?type=solutions" + 
-                  "&{nid_type}={nid}".format(nid_type=nid_type, nid=nid) +
-                  "&fields=" + ','.join(sele_cols) + 
-                  "&select_as=" + ','.join(col_names))
-            curl_cmd = "curl '{}'".format(url)
-            self.logger.debug(curl_cmd)
-            return curl_cmd
+        def _format_url(nids, nid_type='solnid'):
+            url = fetch.eterna_url('solutions', fields=sele_cols, 
+                                   select_as=col_names, **{nid_type: nids})
+            self.logger.debug(url)
+            return url
 
         # read source file
         source_df = util.load_dataframe(self.options.source, 
@@ -292,12 +430,11 @@ class FusionUtil():
                 return list(set(s)) if type(s) == list else [s]
      
 
-        ### get unique puzzle ids
-        def get_puzzle_ids():
-            puzzle_ids = []
+        ### get one design per puzzle
+        def get_puzzle_solnids():
 
-            # curl commands
-            cmd_list = []
+            # solnids
+            solnids = []
             puz_df = source_df.copy()
             
             # query all designs when missing puzzle names
@@ -315,40 +452,77 @@ class FusionUtil():
             puz_df = puz_df.set_index(['Puzzle_Name', 'Synthesis_Round'])
             self.logger.debug(list(set(puz_df.index)))
             for puzzle_name in list(set(puz_df.index)):
-                cmd_list += [_format_curl(
-                    get_unique(puz_df.ix[puzzle_name]['Design_ID']).pop(),
-                    nid_type='solnid')]
+                solnids += [
+                    get_unique(puz_df.ix[puzzle_name]['Design_ID']).pop()]
                 logger.debug("querying db for puzzle: {}".format(puzzle_name))
                 logger.debug("query solnid: {}".format(
                     get_unique(puz_df.ix[puzzle_name]['Design_ID']).pop()))
-
-            # apply commands async
-            results_async = util.map_async(util.submit_command, cmd_list)
-            for d in results_async.get():
-                d = json.loads(d.replace("\\r", " "))
-                try:
-                    d = d['data']['solutions']
-                    self.logger.debug(d)
-                    for sol_data in d:
-                        puzzle_ids +=[sol_data['Puzzle_ID']]
-                except Exception, e:
-                    self.logger.debug("[error]", e, "\n[error]", d)
+            return solnids
+
+
+        # look up puzzle ids (solnid), and fetch all solutions of each
+        # puzzle (puznid) as soon as its id arrives, coalescing ids into
+        # multi-id requests
+        data, nids = [], set()
+        def fetch_rows(url):
+            # stream the solutions, keeping only the selected fields
+            return [map(_.get, col_names) for _ in fetch.fetch_records(
+                url, keys=['data', 'solutions'])]
+
+        with fetch.FetchPool(limit=self.options.concurrency,
+                             func=fetch_rows) as pool:
+            batches = dict((nid_type, fetch.BatchQueue(
+                pool, lambda ids, t=nid_type: _format_url(ids, nid_type=t),
+                tag=nid_type, max_ids=self.options.batch_size))
+                           for nid_type in ['solnid', 'puznid'])
+            for solnid in get_puzzle_solnids():
+                batches['solnid'].add(solnid)
+            batches['solnid'].flush()
+
+            for (nid_type, ids), url, rows, error in pool.as_completed():
+                if error is not None:
+                    if len(ids) > 1:
+                        # endpoint rejected the batch, fall back to single ids
+                        self.logger.warning("{} (url={}), retrying {} ids "
+                            "one by one".format(error, url, len(ids)))
+                        batches[nid_type].retry(ids)
+                    else:
+                        self.logger.error("{} (url={})".format(error, url))
                     continue
-            return list(set(puzzle_ids))
 
-
-        # get unique puzzle ids, generate curl commands
-        nids = get_puzzle_ids()
-        cmd_list = [_format_curl(nid, nid_type='puznid') for nid in nids]
-        self.logger.debug("puzzle nids = {}".format(nids))
-        self.logger.debug("\n" + pprint.pformat(cmd_list))
-
-        # process results
-        results_async = util.map_async(util.submit_command, cmd_list)
-        data = util.load_json(results_async, async=True, 
-            keys=['data','solutions'])
+                # ids without rows, i.e. the endpoint honored part of a batch
+                key = col_names.index(
+                    'Design_ID' if nid_type == 'solnid' else 'Puzzle_ID')
+                returned = set(str(row[key]) for row in rows)
+                missing = [_ for _ in ids if str(_) not in returned]
+                if missing and len(ids) > 1:
+                    self.logger.warning("no solutions for {} of {} ids (url={})"
+                        ", retrying them one by one".format(
+                            len(missing), len(ids), url))
+                    batches[nid_type].retry(missing)
+                elif missing:
+                    self.logger.error("no solutions (url={})".format(url))
+
+                if nid_type == 'puznid':
+                    data.append(rows)
+
+                else:
+                    self.logger.debug(rows)
+                    for row in rows:
+                        nid = row[col_names.index('Puzzle_ID')]
+                        if nid is None or nid in nids:
+                            continue
+                        nids.add(nid)
+                        batches['puznid'].add(nid)
+
+                # send partial batches once nothing else is in flight
+                if not pool.pending:
+                    for batch in batches.values():
+                        batch.flush()
+
+        self.logger.debug("puzzle nids = {}".format(sorted(nids)))
         self.logger.debug(pprint.pformat([__ for _ in data for __ in _][:2]))
-        eterna_data = [map(_.get, col_names) for d in data for _ in d]
+        eterna_data = [row for rows in data for row in rows]
         #self.logger.debug(pprint.pformat(eterna_data))
         
         # write data to file, convert types for successful join 
@@ -359,22 +533,19 @@ class FusionUtil():
         print source_df.dtypes
         self.df = source_df.join(self.df.set_index('Design_ID'), 
                                   on='Design_ID', how='left')
-        pprint.pprint(self.df)
+        self.logger.debug(pprint.pformat(self.df))
 
         ### TODO: hacky... 
         def get_project_info(project_id):
             """
             """
-            url = str("http://staging.eternagame.org/get/?type=project" + 
-                      "&nid={}".format(project_id))
-            curl_cmd = "curl '{}'".format(url)
+            url = fetch.eterna_url('project', nid=project_id)
             if self.options.verbose:
-                print '[command]\t{}'.format(curl_cmd)
+                print '[url]\t{}'.format(url)
 
-            o = util.submit_command(curl_cmd, verbose=False)
-            d = json.loads(o, encoding='utf-8')
             project_name, project_round, puzzle_names = "", "", {}
             try:
+                d = fetch.fetch_json(url)
                 project = d['data']['lab']
                 project_name = project['title'].encode('utf-8')
                 project_round = project['puzzles'][0]['round']
@@ -422,34 +593,21 @@ class FusionUtil():
             return (project_name, project_round, puzzle_names)
                   
       
-        groups = self.df.groupby(['Project_ID', 'Project_Round']).groups
-        logger.debug(groups.keys())
-
-        self.df['Project_Name'] = self.df.Project_ID.map(lambda x: '')
-        for idx, (gkey, groupindex) in enumerate(groups.iteritems()):
-            groupmask = groupindex
-            logger.debug("{}, {}, {}".format(idx,gkey,
-                groupmask[:min(5, len(groupmask))]))
-            project_info = get_project_info(gkey[0])
-            logger.debug(project_info)
-            logger.debug(len(self.df[self.df.index.isin(groupindex)]))
-            try:
-                logger.debug(self.df[self.df.index.isin(groupindex)].head())
-                self.df.Project_Name[self.df.index.isin(groupindex)] = project_info[0]
-                self.df.Project_Round[self.df.index.isin(groupindex)] = project_info[1]
-                self.df.Puzzle_Round[self.df.index.isin(groupindex)] = project_info[1]
-                logger.debug(self.df[self.df.index.isin(groupindex)].head())
-            
-            except Exception as e:
-                logger.error(e)
-                logger.debug('iterating groupindex: {}'.format(groupindex))
-                for gidx in groupindex:
-                    logger.debug("df[gidx={}]: {}"
-                                 .format(gidx,pprint.pformat(self.df[gidx])))
-                    self.df.Project_Name[gidx] = project_info[0] #self.df.Project_ID.map(lambda x: '')
-                    self.df.Project_Round[gidx] = project_info[1]
-                    self.df.Puzzle_Round[gidx] = project_info[1] 
-            
+        # fetch info once per project, then join it back in one pass
+        mask = self.df.Project_ID.notnull() & self.df.Project_Round.notnull()
+        project_ids = list(self.df.Project_ID[mask].unique())
+        logger.debug(project_ids)
+        project_info = pd.DataFrame(
+            [_[:2] for _ in util.map_async(get_project_info, project_ids).get()],
+            index=project_ids, columns=['Project_Name', 'Project_Round'])
+        logger.debug(project_info)
+
+        info = self.df.loc[mask, ['Project_ID']].join(
+            project_info, on='Project_ID')
+        self.df['Project_Name'] = ''
+        self.df.loc[mask, 'Project_Name'] = info.Project_Name
+        self.df.loc[mask, 'Project_Round'] = info.Project_Round
+        self.df.loc[mask, 'Puzzle_Round'] = info.Project_Round
 
         logger.debug(self.df.head())
         if self.options.outfile:
@@ -466,13 +624,10 @@ class FusionUtil():
         def get_nstates(project_id):
             """
             """
-            url = str("http://staging.eternagame.org/get/?type=project" + 
-                      "&nid={}".format(project_id))
-            curl_cmd = "curl '{}'".format(url)
-            self.logger.debug(curl_cmd)
+            url = fetch.eterna_url('project', nid=project_id)
+            self.logger.debug(url)
 
-            o = util.submit_command(curl_cmd, verbose=False)
-            d = json.loads(o, encoding='utf-8')
+            d = fetch.fetch_json(url)
 
             n_states = {}
             try:
@@ -489,7 +644,8 @@ class FusionUtil():
 
 
         source_df = util.load_dataframe(
-            self.options.source).set_index('Puzzle_ID')
+            self.options.source, schema=schema.ETERNA_SCHEMA
+            ).set_index('Puzzle_ID')
         puzzle_ids = list(set(source_df.index))
 
         n_states = get_nstates(get_unique(source_df['Project_ID']).pop())
@@ -522,11 +678,8 @@ class FusionUtil():
                       'State_Count']
         self.df = pd.DataFrame(puzzles, columns=new_header) 
 
-        # HACKY: ensure ids are ints
-        int_cols = ["Project_ID", "Puzzle_ID"]
-        for int_col in int_cols:
-            self.df[int_col] = self.df[int_col].map(
-                lambda _: "{:.0f}".format(_) if '.' in str(_) else _)
+        # ensure ids are ints
+        self.df = schema.normalize_ids(self.df, ["Project_ID", "Puzzle_ID"])
 
         if self.options.outfile:
             util.write_dataframe(self.df, self.options.outfile)
@@ -568,6 +721,16 @@ if __name__=="__main__":
 
     parser.add_argument('--column-file', dest='column_file', default=None) 
     parser.add_argument('--cloud-round', dest='cloud_round', default=None)
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="stream --source in chunks of this many rows")
+    parser.add_argument('--concurrency', type=int, default=fetch.CONCURRENCY,
+                        help="max eterna requests in flight")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="max requests per second, per host "
+                             "(default: none, slowed down only on 429)")
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        default=fetch.BATCH_SIZE,
+                        help="max ids per eterna request (1 disables batching)")
 
     parser.add_argument('--tableID', default=None)
     parser.add_argument('--token', default=None)
@@ -576,12 +739,23 @@ if __name__=="__main__":
     parser.add_argument('--verbose', action='store_true')
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--dry', action='store_true')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="don't read/write the parsed-file and response caches")
+    parser.add_argument('--cache-ttl', dest='cache_ttl', type=float, default=None,
+                        help="seconds to reuse cached eterna responses")
+    parser.add_argument('--metrics', action='store_true',
+                        help="record fusion tables request latency, status "
+                             "and bytes, logged on exit")
     
     parser.add_argument('-l', '--log', default='INFO')
     args = parser.parse_args()
     
     # init log levels
     util.configure_logging(level=args.log.upper())
+    cache.configure_cache(enabled=args.cache, response_ttl=args.cache_ttl)
+    scheduler.configure_scheduler(rate=args.rate)
+    if args.metrics:
+        metrics.enable()
 
     ### modes...
     args.mode = args.mode.lower()
@@ -589,6 +763,8 @@ if __name__=="__main__":
     status = fusion_util.apply_mode()
     if args.verbose:
         print status 
+    if args.metrics:
+        logger.info("metrics:\n{}".format(pprint.pformat(metrics.snapshot())))
 
 
  